@@ -0,0 +1,162 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src'))
+
+from commands import ItemsPagesCommandHandler
+from scrapers import SkinScraper, SunScraper, CleaningScraper, PARSERS, scrape_html
+from server import FixtureServer, FIXTURES, load_fixture
+import network
+
+BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+TOLERANCE = 0.25
+REPEAT = 200
+CHAIN_REPEAT = 3
+ROUNDS = 5
+MEMORY_ROUNDS = 4
+LATENCY = 0.02
+PAGES = 5
+WORKERS = 8
+SCRAPERS = {'skin': SkinScraper, 'sun': SunScraper, 'cleaning': CleaningScraper}
+CHAINS = {
+    'skin': ('skin', 'Personal Care', 'Skin', 'Bar Soap'),
+    'sun': ('skin', 'Personal Care', 'Sun', 'Daily use SPF'),
+    'cleaning': ('cleaning', 'Household', 'All Purpose', 'General Purpose Cleaner'),
+}
+
+
+def measure(run, repeat, rounds=ROUNDS):
+    run()
+    best = 0.0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        operations = 0
+        for _ in range(max(repeat // rounds, 1)):
+            operations += run()
+        best = max(best, operations / (time.perf_counter() - started))
+    peaks = []
+    for _ in range(MEMORY_ROUNDS):
+        tracemalloc.start()
+        try:
+            run()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return {'ops_per_sec': round(best, 2), 'peak_kib': round(min(peaks) / 1024, 1)}
+
+
+def scrape_item_benchmark(kind, parser, directory):
+    html = load_fixture(kind, 'product', directory)
+
+    def run():
+        data, _ = scrape_html(SCRAPERS[kind], html, parser, category='benchmark', db='benchmark', url='benchmark')
+        if not data:
+            raise RuntimeError(f'{kind} product fixture did not produce an item')
+        return 1
+    return run
+
+
+def scrape_items_page_benchmark(kind, parser, directory):
+    html = load_fixture(kind, 'listing', directory)
+
+    def run():
+        _, links = SCRAPERS[kind](html, parser).scrape_items_page()
+        if not links:
+            raise RuntimeError(f'{kind} listing fixture did not produce any links')
+        return 1
+    return run
+
+
+def chain_benchmark(server, kind, parser, use_async, workers):
+    db, category, subcategory, child = CHAINS[kind]
+    args = {'db': db, 'category': category, 'subcategory': subcategory, 'child': child,
+            'items_url': server.listing_url(kind), 'url': None, 'limit': float('inf'), 'workers': workers,
+            'use_async': use_async, 'pool_size': workers + 2, 'parser': parser, 'prefetch': 1,
+            'fields': None, 'listing_only': False}
+    expected = server.pages * server.products_per_page(kind)
+
+    def run():
+        handler = ItemsPagesCommandHandler(args)
+        chunks = handler.process_async() if use_async else handler.process()
+        items = sum(len(chunk) for chunk in chunks)
+        if items != expected:
+            raise RuntimeError(f'{kind} chain scraped {items} items instead of {expected}')
+        return items
+    return run
+
+
+def benchmarks(server, args):
+    for kind in SCRAPERS:
+        for parser in args.parsers:
+            yield f'scrape_item[{kind},{parser}]', scrape_item_benchmark(kind, parser, args.fixtures), args.repeat
+            yield f'scrape_items_page[{kind},{parser}]', \
+                scrape_items_page_benchmark(kind, parser, args.fixtures), args.repeat
+            for use_async in (False, True):
+                name = f'chain[{kind},{parser},{"async" if use_async else "sync"}]'
+                yield name, chain_benchmark(server, kind, parser, use_async, args.workers), args.chain_repeat
+
+
+def compare(name, result, baseline, tolerance):
+    expected = baseline.get(name)
+    if expected is None:
+        return []
+    regressions = []
+    if result['ops_per_sec'] < expected['ops_per_sec'] * (1 - tolerance):
+        regressions.append(f"{name}: {result['ops_per_sec']} ops/s, baseline {expected['ops_per_sec']} ops/s")
+    if result['peak_kib'] > expected['peak_kib'] * (1 + tolerance):
+        regressions.append(f"{name}: {result['peak_kib']} KiB peak, baseline {expected['peak_kib']} KiB")
+    return regressions
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    parser = argparse.ArgumentParser(description='Benchmark EWG scrapers against recorded fixtures.')
+    parser.add_argument('-only', type=str, help='run only benchmarks whose name contains this string')
+    parser.add_argument('-parsers', type=str, nargs='+', choices=PARSERS, default=PARSERS)
+    parser.add_argument('-repeat', type=int, default=REPEAT)
+    parser.add_argument('-chain_repeat', type=int, default=CHAIN_REPEAT)
+    parser.add_argument('-latency', type=float, default=LATENCY)
+    parser.add_argument('-pages', type=int, default=PAGES)
+    parser.add_argument('-workers', type=int, default=WORKERS)
+    parser.add_argument('-fixtures', type=str, default=FIXTURES)
+    parser.add_argument('-baseline', type=str, default=BASELINE)
+    parser.add_argument('-tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('-save', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    network.limiter.configure(None)
+    settings = {'latency': args.latency, 'pages': args.pages, 'workers': args.workers,
+                'fixtures': os.path.relpath(args.fixtures, BENCHMARKS_DIR)}
+    baseline = {'settings': settings, 'results': {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    comparable = baseline['settings'] == settings
+    if not comparable and not args.save:
+        print(f"Baseline was recorded with {baseline['settings']}, skipping the regression check")
+    results, regressions = {}, []
+    with FixtureServer(args.latency, args.pages, args.fixtures) as server:
+        for name, run, repeat in benchmarks(server, args):
+            if args.only and args.only not in name:
+                continue
+            results[name] = measure(run, repeat, min(repeat, ROUNDS))
+            if comparable:
+                regressions.extend(compare(name, results[name], baseline['results'], args.tolerance))
+            print(f"{name:45} {results[name]['ops_per_sec']:>12.2f} ops/s {results[name]['peak_kib']:>10.1f} KiB peak")
+    if args.save:
+        previous = baseline['results'] if comparable else {}
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'settings': settings, 'results': {**previous, **results}}, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f'Baseline saved to {args.baseline}')
+    elif regressions:
+        print(f'{len(regressions)} regressions against {args.baseline} (tolerance {args.tolerance:.0%}):')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
@@ -0,0 +1,116 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gzip
+import os
+import re
+import threading
+import time
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+KINDS = ['skin', 'sun', 'cleaning']
+PRODUCT_LINKS = {
+    'skin': re.compile(r'href="(/skindeep/products/[^"]+)"'),
+    'sun': re.compile(r'href="(https://www\.ewg\.org/sunscreen/rating\.php\?id=\d+)"'),
+    'cleaning': re.compile(r'href="(/guides/cleaners/[^"]+)"'),
+}
+PAGINATION = {
+    'skin': (re.compile(r'<a class="next_page"[^>]*>.*?</a>', re.DOTALL),
+             '<a class="next_page" href="{url}">next</a>'),
+    'sun': (re.compile(r'<ul class="cd-pagination">.*?</ul>', re.DOTALL),
+            '<ul class="cd-pagination"><li class="button"><a href="{url}">Next</a></li></ul>'),
+    'cleaning': (re.compile(r'<a class="next_page"[^>]*>.*?</a>', re.DOTALL),
+                 '<a class="next_page" href="{url}">next</a>'),
+}
+
+
+def load_fixture(kind, page, directory=FIXTURES):
+    with open(os.path.join(directory, f'{kind}_{page}.html'), encoding='utf-8') as fixture:
+        return fixture.read()
+
+
+class FixtureServer:
+
+    def __init__(self, latency=0.0, pages=5, directory=FIXTURES, port=0):
+        self.latency = latency
+        self.pages = pages
+        self.listings = {kind: load_fixture(kind, 'listing', directory) for kind in KINDS}
+        self.products = {kind: load_fixture(kind, 'product', directory).encode('utf-8') for kind in KINDS}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.httpd.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def listing_url(self, kind, page=1):
+        return f'{self.base_url}/{kind}/list?page={page}'
+
+    def products_per_page(self, kind):
+        return len(PRODUCT_LINKS[kind].findall(self.listings[kind]))
+
+    def render_listing(self, kind, page):
+        links = iter(range(self.products_per_page(kind)))
+        html = PRODUCT_LINKS[kind].sub(
+            lambda match: f'href="{self.base_url}/{kind}/products/{page}-{next(links)}"', self.listings[kind])
+        pattern, template = PAGINATION[kind]
+        html = pattern.sub('', html)
+        if page < self.pages:
+            html = html.replace('</body>', template.format(url=self.listing_url(kind, page + 1)) + '</body>')
+        return html.encode('utf-8')
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                with server.lock:
+                    server.requests += 1
+                parts = self.path.split('?')[0].strip('/').split('/')
+                if len(parts) < 2 or parts[0] not in KINDS:
+                    self.send_error(404)
+                    return
+                kind = parts[0]
+                if parts[1] == 'list':
+                    page = int(self.path.split('page=')[-1]) if 'page=' in self.path else 1
+                    body = server.render_listing(kind, page)
+                else:
+                    body = server.products[kind]
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body)
+                    encoding = 'gzip'
+                else:
+                    encoding = None
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                if encoding:
+                    self.send_header('Content-Encoding', encoding)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve EWG fixtures locally.')
+    parser.add_argument('-port', type=int, default=8765)
+    parser.add_argument('-latency', type=float, default=0.0)
+    parser.add_argument('-pages', type=int, default=5)
+    args = parser.parse_args()
+    with FixtureServer(args.latency, args.pages, port=args.port) as fixture_server:
+        for kind in KINDS:
+            print(f'{kind}: {fixture_server.listing_url(kind)}')
+        threading.Event().wait()
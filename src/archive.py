@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+from exception import ArchiveMissException
+import gzip
+import json
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.idx'
+
+
+def load_index(path):
+    offsets = {}
+    if not os.path.exists(path + INDEX_SUFFIX):
+        return offsets
+    with open(path + INDEX_SUFFIX) as index_file:
+        for line in index_file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f'Ignoring truncated index record in {path}{INDEX_SUFFIX}')
+                break
+            offsets[entry['url']] = (entry['offset'], entry['length'])
+    return offsets
+
+
+def warc_record(url, html):
+    body = html.encode('utf-8')
+    http_block = b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n' \
+                 b'Content-Length: %d\r\n\r\n' % len(body) + body
+    headers = '\r\n'.join([
+        'WARC/1.0',
+        'WARC-Type: response',
+        f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>',
+        f'WARC-Date: {datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}',
+        f'WARC-Target-URI: {url}',
+        'Content-Type: application/http; msgtype=response',
+        f'Content-Length: {len(http_block)}',
+    ])
+    return headers.encode('utf-8') + b'\r\n\r\n' + http_block + b'\r\n\r\n'
+
+
+def parse_warc_record(record):
+    _, _, block = record.partition(b'\r\n\r\n')
+    _, _, body = block.partition(b'\r\n\r\n')
+    return body[:-4].decode('utf-8')
+
+
+class ArchiveRecorder:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offsets = load_index(path)
+        self.file = open(path, 'ab')
+        self.index = open(path + INDEX_SUFFIX, 'a')
+        logger.info(f'Recording responses to {path} ({len(self.offsets)} already archived)')
+
+    def record(self, url, html):
+        data = gzip.compress(warc_record(url, html))
+        with self.lock:
+            if url in self.offsets:
+                return
+            offset = self.file.tell()
+            self.file.write(data)
+            self.file.flush()
+            self.offsets[url] = (offset, len(data))
+            self.index.write(json.dumps({'url': url, 'offset': offset, 'length': len(data)}) + '\n')
+            self.index.flush()
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+
+class ArchiveReplayer:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offsets = load_index(path)
+        self.file = open(path, 'rb')
+        logger.info(f'Replaying {len(self.offsets)} responses from {path}')
+
+    def get(self, url):
+        location = self.offsets.get(url)
+        if location is None:
+            raise ArchiveMissException(url)
+        offset, length = location
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(length)
+        return parse_warc_record(gzip.decompress(data))
+
+    def close(self):
+        self.file.close()
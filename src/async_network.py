@@ -0,0 +1,108 @@
+import network
+from network import HEADERS, ATTEMPTS, TIMEOUT, limiter, breaker, retry_policy, stats, check_status, \
+    acquire_route, release_route, request_headers, retry_reason, counts_against_host
+from metrics import RETRIES, CACHE_HITS
+import aiohttp
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+LIMIT = 100
+LIMIT_PER_HOST = 20
+KEEPALIVE_TIMEOUT = 30
+
+
+class AsyncFetcher:
+
+    def __init__(self, limit=LIMIT, limit_per_host=LIMIT_PER_HOST):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=KEEPALIVE_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, headers=HEADERS,
+                                             timeout=aiohttp.ClientTimeout(total=TIMEOUT))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get_html_by_url(self, url, attempts=ATTEMPTS):
+        if network.replayer is not None:
+            return network.replayer.get(url)
+        html = await self._fetch_html(url, attempts)
+        if network.recorder is not None:
+            network.recorder.record(url, html)
+        return html
+
+    async def _fetch_html(self, url, attempts):
+        cache = network.cache
+        entry = cache.get(url) if cache is not None else None
+        if entry is not None and cache.is_fresh(entry):
+            logger.debug(f'Cache hit {url}')
+            CACHE_HITS.inc(outcome='fresh')
+            return entry['body']
+        attempt = 0
+        while True:
+            try:
+                return await self._request_html(url, entry)
+            except Exception as e:
+                if attempt >= attempts or not retry_policy.should_retry(e):
+                    if counts_against_host(e):
+                        breaker.record_failure(url)
+                    raise
+                delay = retry_policy.backoff(attempt, e)
+                attempt += 1
+                RETRIES.inc(reason=retry_reason(e))
+                logger.debug(f'Something went wrong ({e}), try request again {url} in {delay:.1f} seconds.')
+                await asyncio.sleep(delay)
+
+    async def _request_html(self, url, entry):
+        cache = network.cache
+        delay = breaker.reserve(url)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = breaker.reserve(url)
+        proxy, route = acquire_route()
+        delay = limiter.reserve(url, route)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        started = time.monotonic()
+        try:
+            async with self.session.get(url, headers=request_headers(entry, proxy), proxy=route) as response:
+                body = await response.read()
+        except Exception:
+            release_route(url, proxy, error=True)
+            raise
+        elapsed = time.monotonic() - started
+        release_route(url, proxy, elapsed, response.status)
+        wire_bytes = int(response.headers.get('Content-Length', len(body)))
+        stats.record(url, wire_bytes, len(body), elapsed)
+        check_status(url, response.status, response.headers, route)
+        if entry is not None and response.status == 304:
+            logger.debug(f'Cache revalidated {url}')
+            CACHE_HITS.inc(outcome='revalidated')
+            cache.revalidated(url, entry)
+            return entry['body']
+        html = await response.text()
+        if cache is not None and response.status == 200:
+            cache.put(url, html, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return html
+
+
+def iterate_async(agen):
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
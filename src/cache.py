@@ -0,0 +1,89 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = 24 * 60 * 60
+CACHE_SIZE = 1024
+EVICT_RATIO = 0.9
+
+
+class ResponseCache:
+
+    def __init__(self, directory, ttl=CACHE_TTL, max_size=CACHE_SIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size * 1024 * 1024
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self._files())
+
+    def _files(self):
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith('.gz'):
+                    yield os.path.join(root, filename)
+
+    def _path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], f'{key}.gz')
+
+    def get(self, url):
+        path = self._path(url)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as cache_file:
+                entry = json.loads(cache_file.readline())
+                entry['body'] = cache_file.read()
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception(f'Corrupted cache entry for {url}, ignoring it')
+            return None
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, body, etag=None, last_modified=None):
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = {'url': url, 'etag': etag, 'last_modified': last_modified, 'fetched_at': time.time()}
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as cache_file:
+            cache_file.write(json.dumps(meta) + '\n')
+            cache_file.write(body)
+        with self.lock:
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self.size += os.path.getsize(path)
+            if self.size > self.max_size:
+                self._evict()
+
+    def revalidated(self, url, entry):
+        self.put(url, entry['body'], entry.get('etag'), entry.get('last_modified'))
+
+    def _evict(self):
+        files = sorted(self._files(), key=os.path.getmtime)
+        target = self.max_size * EVICT_RATIO
+        for path in files:
+            if self.size <= target:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.size -= size
+        logger.debug(f'Evicted cache entries down to {self.size} bytes')
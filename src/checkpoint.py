@@ -0,0 +1,77 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def child_key(args):
+    return (args['db'], args['category'], args['subcategory'], args['child'])
+
+
+class CheckpointStore:
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed_children = set()
+        self.cursors = {}
+        self.scraped_urls = set()
+        if resume and os.path.exists(path):
+            self._load()
+        self.file = open(path, 'a' if resume else 'w')
+
+    def _events(self):
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f'Ignoring truncated checkpoint record in {self.path}')
+                    return
+
+    def _load(self):
+        for event in self._events():
+            key = tuple(event['child'])
+            if event.get('done'):
+                self.completed_children.add(key)
+            else:
+                self.cursors[key] = event['next_page']
+                self.scraped_urls.update((key, url) for url in event['urls'])
+        logger.info(f'Resuming from {self.path}: {len(self.completed_children)} children done, '
+                    f'{len(self.scraped_urls)} items scraped')
+
+    def items(self):
+        seen = set()
+        for event in self._events():
+            key = tuple(event['child'])
+            for item in event.get('items', []):
+                if (key, item['Url']) not in seen:
+                    seen.add((key, item['Url']))
+                    yield item
+
+    def is_child_done(self, key):
+        return key in self.completed_children
+
+    def is_scraped(self, key, url):
+        return (key, url) in self.scraped_urls
+
+    def record_page(self, key, next_page, urls, items):
+        with self.lock:
+            self.cursors[key] = next_page
+            self.scraped_urls.update((key, url) for url in urls)
+            self._append({'child': key, 'next_page': next_page, 'urls': list(urls), 'items': items})
+
+    def record_child(self, key):
+        with self.lock:
+            self.completed_children.add(key)
+            self._append({'child': key, 'done': True})
+
+    def _append(self, event):
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
@@ -17,3 +17,7 @@ CHEMICALS = 'Chemicals'
 SKIN_DEEP = 'Skin Deep'
 ALLERGIES_IMMUNOTOXICITY = 'Allergies & Immunotoxicity'
 USE_RESTRICTIONS = 'Use restrictions'
+
+SECTION = 'Section'
+LEVEL = 'Level'
+DB = 'db'
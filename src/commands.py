@@ -1,9 +1,18 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import chain
+import asyncio
 import logging
 from exception import InvalidArgsException
 from url_config import EWG_DATABASES
+from context import CrawlContext
+from scrapers import scrape_html
+from metrics import ITEMS, QUEUE_DEPTH, IN_FLIGHT, record_timings
+from checkpoint import child_key
 from network import get_html_by_url
-import time
+from pipeline import prefetch, aprefetch, interleave, ainterleave
+from async_network import AsyncFetcher, iterate_async
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +46,7 @@ class CommandHandlerFactory:
 
 
     @staticmethod
-    def getCommandByArguments(args):
+    def getCommandByArguments(args, context=None):
 
         def is_default_command(args):
             return all(value is None for value in args.values())
@@ -59,157 +68,389 @@ class CommandHandlerFactory:
 
         CommandHandlerFactory._validate_args(args)
         if is_default_command(args):
-            return DefaultCommandHandler(args)
+            return DefaultCommandHandler(args, context)
         if is_url_scrape_command(args):
-            return ItemCommandHandler(args)
+            return ItemCommandHandler(args, context)
         if is_child_command(args):
-            return ChildCommandHandler(args)
+            return ChildCommandHandler(args, context)
         if is_subcategory_command(args):
-            return SubcategoryCommandHandler(args)
+            return SubcategoryCommandHandler(args, context)
         if is_category_command(args):
-            return CategoryCommandHandler(args)
+            return CategoryCommandHandler(args, context)
         if is_database_command(args):
-            return DatabaseCommandHandler(args)
-        return DefaultCommandHandler(args)
+            return DatabaseCommandHandler(args, context)
+        return DefaultCommandHandler(args, context)
 
 class CommandHandler(ABC):
 
-    def __init__(self, args):
+    def __init__(self, args, context=None):
         self.args = args
+        self.context = context or CrawlContext()
 
     @abstractmethod
-    def process(self):
+    def children(self):
         pass
 
+    def process(self):
+        for handler in self.children():
+            for chunk_result in handler.process():
+                yield chunk_result
+
+    async def aprocess(self, fetcher):
+        for handler in self.children():
+            chunks = handler.aprocess(fetcher)
+            try:
+                async for chunk_result in chunks:
+                    yield chunk_result
+            finally:
+                await chunks.aclose()
+
+    def leaves(self):
+        for handler in self.children():
+            yield from handler.leaves()
+
+    def process_async(self):
+        async def run():
+            async with AsyncFetcher(limit_per_host=self.args['pool_size']) as fetcher:
+                chunks = self.aprocess(fetcher)
+                try:
+                    async for chunk_result in chunks:
+                        yield chunk_result
+                finally:
+                    await chunks.aclose()
+        return iterate_async(run())
+
+    def process_parallel(self, parallel):
+        logger.info(f'Scraping up to {parallel} children in parallel with {self.args["workers"]} workers')
+        with ThreadPoolExecutor(max_workers=self.args['workers']) as executor:
+            self.context.item_executor = executor
+            try:
+                yield from interleave((leaf.process() for leaf in self.leaves()), parallel)
+            finally:
+                self.context.item_executor = None
+
+    def process_parallel_async(self, parallel):
+        async def run():
+            logger.info(f'Scraping up to {parallel} children in parallel with {self.args["workers"]} in-flight requests')
+            async with AsyncFetcher(limit_per_host=self.args['pool_size']) as fetcher:
+                self.context.item_semaphore = asyncio.Semaphore(self.args['workers'])
+                chunks = ainterleave((leaf.aprocess(fetcher) for leaf in self.leaves()), parallel)
+                try:
+                    async for chunk_result in chunks:
+                        yield chunk_result
+                finally:
+                    await chunks.aclose()
+                    self.context.item_semaphore = None
+        return iterate_async(run())
+
 
 class DefaultCommandHandler(CommandHandler):
 
-    def __init__(self, args):
-        super(DefaultCommandHandler, self).__init__(args)
+    def __init__(self, args, context=None):
+        super(DefaultCommandHandler, self).__init__(args, context)
 
-    def process(self):
+    def children(self):
         logger.info("Scraping all EWG databases")
         for db_name in EWG_DATABASES.keys():
             command_args = {**self.args, 'db': db_name}
-            handler = DatabaseCommandHandler(command_args)
-            for chunk_result in handler.process():
-                yield chunk_result
+            yield DatabaseCommandHandler(command_args, self.context)
 
 
 class DatabaseCommandHandler(CommandHandler):
     
-    def __init__(self, args):
-        super(DatabaseCommandHandler, self).__init__(args)
+    def __init__(self, args, context=None):
+        super(DatabaseCommandHandler, self).__init__(args, context)
     
-    def process(self):
+    def children(self):
         db = EWG_DATABASES[self.args['db']]
         logger.info(f"Scraping database {self.args['db']}")
         for category_name in db.keys():
             command_args = {**self.args, 'category': category_name}
-            handler = CategoryCommandHandler(command_args)
-            for chunk_result in handler.process():
-                yield chunk_result
+            yield CategoryCommandHandler(command_args, self.context)
 
 
 class CategoryCommandHandler(CommandHandler):
 
-    def __init__(self, args):
-        super(CategoryCommandHandler, self).__init__(args) 
+    def __init__(self, args, context=None):
+        super(CategoryCommandHandler, self).__init__(args, context) 
 
-    def process(self):
+    def children(self):
         category = EWG_DATABASES[self.args['db']][self.args['category']]
         logger.info(f"Scraping category {self.args['category']}")
         for subcategory_name in category.keys():
             command_args = {**self.args, 'subcategory': subcategory_name}
-            handler = SubcategoryCommandHandler(command_args)
-            for chunk_result in handler.process():
-                yield chunk_result
+            yield SubcategoryCommandHandler(command_args, self.context)
 
 
 class SubcategoryCommandHandler(CommandHandler):
 
-    def __init__(self, args):
-        super(SubcategoryCommandHandler, self).__init__(args)
+    def __init__(self, args, context=None):
+        super(SubcategoryCommandHandler, self).__init__(args, context)
     
-    def process(self):
+    def children(self):
         subcategory = EWG_DATABASES[self.args['db']][self.args['category']][self.args['subcategory']]
         logger.info(f"Scraping subcategory {self.args['subcategory']}")
         for child in subcategory['child']:
             command_args = {**self.args, 'child': child}
-            handler = ChildCommandHandler(command_args)
-            for chunk_result in handler.process():
-                yield chunk_result
+            yield ChildCommandHandler(command_args, self.context)
 
 
 class ChildCommandHandler(CommandHandler):
     
-    def __init__(self, args):
-        super(ChildCommandHandler, self).__init__(args) 
+    def __init__(self, args, context=None):
+        super(ChildCommandHandler, self).__init__(args, context)
+        self.failed = False
 
-    def process(self):
+    def children(self):
         child =  EWG_DATABASES[self.args['db']][self.args['category']][self.args['subcategory']]['child'][self.args['child']]
         base_url = EWG_DATABASES[self.args['db']][self.args['category']][self.args['subcategory']]['base_url']
         items_url = base_url + child
+        checkpoint = self.context.checkpoint
+        key = child_key(self.args)
+        if checkpoint is not None:
+            if checkpoint.is_child_done(key):
+                logger.info(f"Child {self.args['child']} is already scraped, skipping...")
+                return
+            items_url = checkpoint.cursors.get(key, items_url)
         command_args = {**self.args, 'items_url': items_url}
         logger.info(f"Scraping child {self.args['child']}")
-        handler = ItemsPagesCommandHandler(command_args)
-        for chunk_result in handler.process():
-            yield chunk_result
+        handler = ItemsPagesCommandHandler(command_args, self.context)
+        yield handler
+        self.failed = handler.failed
+        if checkpoint is not None and not handler.failed:
+            checkpoint.record_child(key)
+
+    def leaves(self):
+        yield self
 
 
 class ItemsPagesCommandHandler(CommandHandler):
 
-    def __init__(self, args):
-        super(ItemsPagesCommandHandler, self).__init__(args)
+    def __init__(self, args, context=None):
+        super(ItemsPagesCommandHandler, self).__init__(args, context)
+        self.failed = False
+
+    def children(self):
+        return []
+
+    def _scraper_cls(self):
+        return EWG_DATABASES[self.args['db']][self.args['category']][self.args['subcategory']]['scraper']
+
+    def _scrape_items_page(self, items_url, html):
+        scraper = self._scraper_cls()(html, self.args['parser'])
+        logger.info(f'Scraping items page {items_url}')
+        next_page, entries = scraper.scrape_items_page_entries()
+        records = {}
+        if self.args['listing_only']:
+            records = scraper.scrape_listing_records(category=self.args['subcategory'], db=self.args['db'])
+        record_timings(scraper.timings)
+        return next_page, entries, records
+
+    def _pending_links(self, entries):
+        links = list(entries)
+        key = child_key(self.args)
+        checkpoint = self.context.checkpoint
+        if checkpoint is not None:
+            links = [link for link in links if not checkpoint.is_scraped(key, link)]
+        frontier = self.context.frontier
+        if frontier is not None:
+            links = [link for link in links if frontier.claim(link, key)]
+        index = self.context.index
+        if index is not None:
+            changed = set(index.changed(entries))
+            links = [link for link in links if link in changed]
+        return links
+
+    def _known_page(self, entries):
+        index = self.context.index
+        if index is None or not entries or index.changed(entries):
+            return False
+        logger.info('Every product on the page is already known, stopping pagination')
+        return True
+
+    def _finish_page(self, next_page, entries, results):
+        chunks = []
+        scraped = []
+        for item_link, data, failed in results:
+            chunks.extend(data)
+            if not failed:
+                scraped.append(item_link)
+            elif self.context.frontier is not None:
+                self.context.frontier.release(item_link)
+        if self.context.checkpoint is not None:
+            self.context.checkpoint.record_page(child_key(self.args), next_page, scraped, chunks)
+        if self.context.index is not None:
+            self.context.index.update({link: entries[link] for link in scraped})
+        return chunks
+
+    def _listed(self, links, records):
+        listed = [(link, [records[link]], False) for link in links if link in records]
+        if listed:
+            ITEMS.inc(len(listed), db=self.args['db'])
+            logger.info(f'Took {len(listed)} of {len(links)} items from listing tiles')
+        return listed, [link for link in links if link not in records]
+
+    def _scrape_item(self, item_link):
+        command_args = {**self.args, 'url': item_link}
+        handler = ItemCommandHandler(command_args, self.context)
+        data = list(handler.process())[0]
+        return item_link, data, handler.failed
+
+    async def _ascrape_item(self, fetcher, semaphore, item_link):
+        async with semaphore:
+            command_args = {**self.args, 'url': item_link}
+            handler = ItemCommandHandler(command_args, self.context)
+            async for data in handler.aprocess(fetcher):
+                return item_link, data, handler.failed
+
+    def _listing_pages(self):
+        items_url = self.args['items_url']
+        while items_url:
+            html = get_html_by_url(items_url)
+            next_page, entries, records = self._scrape_items_page(items_url, html)
+            if self._known_page(entries):
+                next_page = None
+            yield next_page, entries, records
+            items_url = next_page
+
+    async def _alisting_pages(self, fetcher):
+        items_url = self.args['items_url']
+        while items_url:
+            html = await fetcher.get_html_by_url(items_url)
+            next_page, entries, records = self._scrape_items_page(items_url, html)
+            if self._known_page(entries):
+                next_page = None
+            yield next_page, entries, records
+            items_url = next_page
 
     def process(self):
         items_url = self.args['items_url']
-        scraper_cls = EWG_DATABASES[self.args['db']][self.args['category']][self.args['subcategory']]['scraper']
-        while items_url:
+        pages = prefetch(self._listing_pages(), self.args['prefetch'])
+        shared = self.context.item_executor
+        with nullcontext(shared) if shared is not None else ThreadPoolExecutor(max_workers=self.args['workers']) as executor:
             try:
-                html = get_html_by_url(items_url)
-                scraper = scraper_cls(html)
-                logger.info(f'Scraping items page {items_url}')
-                next_page, links = scraper.scrape_items_page()
-                chunks = []
-                if links:
-                    logger.info(f'Scraping {len(links)} links: {links}')
-                    for item_link in links:
-                        time.sleep(3)
-                        command_args = {**self.args, 'url': item_link}
-                        handler = ItemCommandHandler(command_args)
-                        data = list(handler.process())[0]
-                        chunks.extend(data)
+                for next_page, entries, records in pages:
+                    links = self._pending_links(entries)
+                    results, fetch_links = self._listed(links, records)
+                    if fetch_links:
+                        logger.info(f'Scraping {len(fetch_links)} links with {self.args["workers"]} workers')
+                        results = chain(results, executor.map(self._scrape_item, fetch_links))
+                    chunks = self._finish_page(next_page, entries, results)
                     items_url = next_page
-                    logger.info(f"Successfully scraped {len(chunks)} links: {chunks}")
-                    yield chunks
+                    if links:
+                        logger.info(f"Successfully scraped {len(chunks)} of {len(links)} links")
+                        yield chunks
+                    if not items_url:
+                        break
             except Exception:
                 logger.exception(f"Couldn't process items page {items_url}, skipping...")
-                items_url = None
+                self.failed = True
                 yield []
+            finally:
+                pages.close()
+
+    async def aprocess(self, fetcher):
+        items_url = self.args['items_url']
+        semaphore = self.context.item_semaphore or asyncio.Semaphore(self.args['workers'])
+        pages = aprefetch(self._alisting_pages(fetcher), self.args['prefetch'])
+        try:
+            async for next_page, entries, records in pages:
+                links = self._pending_links(entries)
+                results, fetch_links = self._listed(links, records)
+                if fetch_links:
+                    logger.info(f'Scraping {len(fetch_links)} links with {self.args["workers"]} in-flight requests')
+                    results += await asyncio.gather(*[self._ascrape_item(fetcher, semaphore, link)
+                                                      for link in fetch_links])
+                chunks = self._finish_page(next_page, entries, results)
+                items_url = next_page
+                if links:
+                    logger.info(f"Successfully scraped {len(chunks)} of {len(links)} links")
+                    yield chunks
+                if not items_url:
+                    break
+        except Exception:
+            logger.exception(f"Couldn't process items page {items_url}, skipping...")
+            self.failed = True
+            yield []
+        finally:
+            await pages.aclose()
 
 
 class ItemCommandHandler(CommandHandler):
 
-    def __init__(self, args):
-        super(ItemCommandHandler, self).__init__(args)
+    def __init__(self, args, context=None):
+        super(ItemCommandHandler, self).__init__(args, context)
+        self.failed = False
 
-    def process(self):
+    def children(self):
+        return []
+
+    def _scraper_args(self):
         db = EWG_DATABASES[self.args['db']]
-        url = self.args['url']
         scraper_cls = db[self.args['category']][self.args['subcategory']]['scraper']
+        kwargs = {'category': self.args['subcategory'], 'db': self.args['db'], 'url': self.args['url'],
+                  'fields': self.args['fields']}
+        return scraper_cls, kwargs
+
+    def _result(self, result):
+        data, timings = result
+        record_timings(timings)
+        if data:
+            ITEMS.inc(db=self.args['db'])
+            logger.debug(f"Successfully scraped url: {self.args['url']}")
+            return [data]
+        return []
+
+    def _scrape(self, html):
+        scraper_cls, kwargs = self._scraper_args()
+        logger.info(f'Scraping item page {self.args["url"]}')
+        if self.context.parse_pool is not None:
+            QUEUE_DEPTH.inc(queue='parse_pool')
+            try:
+                future = self.context.parse_pool.submit(scrape_html, scraper_cls, html, self.args['parser'], **kwargs)
+                return self._result(future.result())
+            finally:
+                QUEUE_DEPTH.dec(queue='parse_pool')
+        return self._result(scrape_html(scraper_cls, html, self.args['parser'], **kwargs))
+
+    async def _ascrape(self, html):
+        scraper_cls, kwargs = self._scraper_args()
+        logger.info(f'Scraping item page {self.args["url"]}')
+        if self.context.parse_pool is not None:
+            QUEUE_DEPTH.inc(queue='parse_pool')
+            try:
+                future = self.context.parse_pool.submit(scrape_html, scraper_cls, html, self.args['parser'], **kwargs)
+                return self._result(await asyncio.wrap_future(future))
+            finally:
+                QUEUE_DEPTH.dec(queue='parse_pool')
+        return self._result(scrape_html(scraper_cls, html, self.args['parser'], **kwargs))
+
+    def process(self):
+        url = self.args['url']
         logger.info(f'Scraping {self.args["db"]} item_url {url}')
-        html = None
+        IN_FLIGHT.inc(stage='item_fetch')
         try:
             html = get_html_by_url(url)
         except Exception:
             logger.exception(f"Couldn't access item_url {url}, skipping...")
+            self.failed = True
             yield []
-        scraper = scraper_cls(html)
-        logger.info(f'Scraping item page {url}')
-        data = scraper.scrape_item(category=self.args['subcategory'], db=self.args['db'], url=url)
-        if data:
-            logger.info(f"Successfully scraped url: {url}, data: {data}")
-            yield [data]
-        else:
+            return
+        finally:
+            IN_FLIGHT.dec(stage='item_fetch')
+        yield self._scrape(html)
+
+    async def aprocess(self, fetcher):
+        url = self.args['url']
+        logger.info(f'Scraping {self.args["db"]} item_url {url}')
+        IN_FLIGHT.inc(stage='item_fetch')
+        try:
+            html = await fetcher.get_html_by_url(url)
+        except Exception:
+            logger.exception(f"Couldn't access item_url {url}, skipping...")
+            self.failed = True
             yield []
+            return
+        finally:
+            IN_FLIGHT.dec(stage='item_fetch')
+        yield await self._ascrape(html)
@@ -0,0 +1,9 @@
+class CrawlContext:
+
+    def __init__(self, checkpoint=None, index=None, parse_pool=None, frontier=None):
+        self.checkpoint = checkpoint
+        self.index = index
+        self.parse_pool = parse_pool
+        self.frontier = frontier
+        self.item_executor = None
+        self.item_semaphore = None
@@ -0,0 +1,203 @@
+from columns import *
+from datetime import datetime
+from exception import InvalidArgsException
+from frontier import url_digest
+from ingredients import IngredientRegistry
+from json_handler import read_items, results_path
+from store import ProductStore, INGREDIENT_SEPARATOR
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS = 64
+SQLITE_HEADER = b'SQLite format 3\x00'
+KINDS = ['added', 'removed', 'changed']
+TRACKED_FIELDS = [PRODUCT_NAME, BRAND, EWG_SCORE, UPC_CODE]
+RESULTS_NAME = re.compile(r'(results_[^_]+)(?:_\w+)?\.n?json')
+SECTIONS = [SKIN_DEEP, CLEANING]
+
+
+def snapshot_items(path):
+    with open(path, 'rb') as snapshot:
+        header = snapshot.read(len(SQLITE_HEADER))
+    if header != SQLITE_HEADER:
+        yield from read_items(path)
+        return
+    store = ProductStore(path)
+    try:
+        yield from store.items()
+    finally:
+        store.close()
+
+
+def is_compacted(data):
+    return isinstance(data.get(LIST_OF_INGREDIENTS), list) or \
+        any(isinstance(chemical, list) for chemical in data.get(CHEMICALS) or [])
+
+
+def ingredients_table(path, table=None):
+    if table is None:
+        match = RESULTS_NAME.fullmatch(os.path.basename(path))
+        if match is not None:
+            table = os.path.join(os.path.dirname(path), f'{match.group(1)}_ingredients.json')
+    if table is None or not os.path.exists(table):
+        raise InvalidArgsException(f'{path} was written with -ingredients, its ingredients table should be specified!')
+    return table
+
+
+def check_snapshot(path, table=None):
+    items = snapshot_items(path)
+    try:
+        first = next(items, None)
+    finally:
+        items.close()
+    if first is not None and is_compacted(first):
+        ingredients_table(path, table)
+
+
+def expanded_items(path, table=None):
+    registry = None
+    for data in snapshot_items(path):
+        if is_compacted(data):
+            if registry is None:
+                registry = IngredientRegistry.load(ingredients_table(path, table))
+            data = registry.expand(data)
+        yield data
+
+
+def _ingredients(data):
+    ingredients = data.get(LIST_OF_INGREDIENTS)
+    return ingredients.split(INGREDIENT_SEPARATOR) if isinstance(ingredients, str) else []
+
+
+def _chemicals(data):
+    return {chemical.get(NAME): [chemical.get(EWG_SCORE), chemical.get(CONCERNS)]
+            for chemical in data.get(CHEMICALS) or []}
+
+
+def _mapping_changes(old, new):
+    changes = {
+        'added': [key for key in new if key not in old],
+        'removed': [key for key in old if key not in new],
+        'changed': {key: [old[key], value] for key, value in new.items() if key in old and old[key] != value},
+    }
+    return {kind: value for kind, value in changes.items() if value}
+
+
+def compare(old, new):
+    changes = {field: [old.get(field), new.get(field)] for field in TRACKED_FIELDS if old.get(field) != new.get(field)}
+    old_ingredients, new_ingredients = _ingredients(old), _ingredients(new)
+    if old_ingredients != new_ingredients:
+        changes[LIST_OF_INGREDIENTS] = _mapping_changes(dict.fromkeys(old_ingredients), dict.fromkeys(new_ingredients)) \
+            or {'reordered': True}
+    chemicals = _mapping_changes(_chemicals(old), _chemicals(new))
+    if chemicals:
+        changes[CHEMICALS] = chemicals
+    for section in SECTIONS:
+        section_changes = _mapping_changes(old.get(section) or {}, new.get(section) or {})
+        if section_changes:
+            changes[section] = section_changes
+    return changes
+
+
+def _summary(data):
+    return {URL: data[URL], PRODUCT_NAME: data.get(PRODUCT_NAME), BRAND: data.get(BRAND), EWG_SCORE: data.get(EWG_SCORE)}
+
+
+class SnapshotDiff:
+
+    def __init__(self, partitions=PARTITIONS):
+        self.partitions = partitions
+        self.groups = {}
+        self.counts = dict.fromkeys(KINDS, 0)
+
+    def _partition_path(self, directory, side, partition):
+        return os.path.join(directory, f'{side}_{partition}.ndjson')
+
+    def _split(self, path, table, directory, side):
+        files = [open(self._partition_path(directory, side, partition), 'w') for partition in range(self.partitions)]
+        count = 0
+        try:
+            for data in expanded_items(path, table):
+                partition = int.from_bytes(url_digest(data[URL]), 'big') % self.partitions
+                files[partition].write(json.dumps(data) + '\n')
+                count += 1
+        finally:
+            for partition_file in files:
+                partition_file.close()
+        logger.info(f'Partitioned {count} items from {path}')
+
+    def _load(self, path):
+        items = {}
+        with open(path) as partition_file:
+            for line in partition_file:
+                data = json.loads(line)
+                items[(url_digest(data[URL]), data.get(DB), data.get(TERA_CATEGORY))] = data
+        os.remove(path)
+        return items
+
+    def _add(self, kind, data, record):
+        group = self.groups.setdefault(data.get(DB), {}).setdefault(data.get(TERA_CATEGORY), {})
+        group.setdefault(kind, []).append(record)
+        self.counts[kind] += 1
+
+    def run(self, old_path, new_path, old_table=None, new_table=None):
+        check_snapshot(old_path, old_table)
+        check_snapshot(new_path, new_table)
+        with tempfile.TemporaryDirectory() as directory:
+            self._split(old_path, old_table, directory, 'old')
+            self._split(new_path, new_table, directory, 'new')
+            for partition in range(self.partitions):
+                old = self._load(self._partition_path(directory, 'old', partition))
+                new = self._load(self._partition_path(directory, 'new', partition))
+                for key, data in new.items():
+                    previous = old.pop(key, None)
+                    if previous is None:
+                        self._add('added', data, _summary(data))
+                        continue
+                    changes = compare(previous, data)
+                    if changes:
+                        self._add('changed', data, {URL: data[URL], PRODUCT_NAME: data.get(PRODUCT_NAME),
+                                                    'changes': changes})
+                for data in old.values():
+                    self._add('removed', data, _summary(data))
+        return self
+
+    def write(self, path):
+        for categories in self.groups.values():
+            for group in categories.values():
+                for records in group.values():
+                    records.sort(key=lambda record: record[URL])
+        with open(path, 'w') as json_file:
+            json.dump({'summary': self.counts, 'changes': self.groups}, json_file)
+
+    def summary(self):
+        return ', '.join(f'{count} {kind}' for kind, count in self.counts.items())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(filename)s %(levelname)s:%(message)s')
+    parser = argparse.ArgumentParser(description='Diff two crawl snapshots (json, ndjson or -store databases).')
+    parser.add_argument('old', type=str)
+    parser.add_argument('new', type=str)
+    parser.add_argument('-output', type=str)
+    parser.add_argument('-partitions', type=int, default=PARTITIONS)
+    parser.add_argument('-old_ingredients', type=str, help='ingredients table of a compacted old snapshot')
+    parser.add_argument('-new_ingredients', type=str, help='ingredients table of a compacted new snapshot')
+    args = vars(parser.parse_args())
+    sys.tracebacklimit = 0
+    try:
+        output = args['output'] or results_path(datetime.now(), '_diff')
+        diff = SnapshotDiff(args['partitions']).run(args['old'], args['new'], args['old_ingredients'],
+                                                    args['new_ingredients'])
+        diff.write(output)
+        logger.info(f'Diff of {args["old"]} and {args["new"]}: {diff.summary()}, written to {output}')
+    except Exception as e:
+        logger.exception(e)
+        sys.exit(1)
@@ -0,0 +1,229 @@
+from commands import ChildCommandHandler
+from checkpoint import child_key
+import json
+import logging
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL = 300
+HEARTBEAT_INTERVAL = LEASE_TTL / 3
+POLL_INTERVAL = 2
+MAX_ATTEMPTS = 3
+SQLITE_TIMEOUT = 60
+COORDINATOR_ARGS = ['-coordinator', '-spawn', '-metrics_file', '-metrics_port', '-profile', '-sample']
+
+
+class WorkQueue:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                                'id INTEGER PRIMARY KEY, child TEXT NOT NULL UNIQUE, '
+                                "state TEXT NOT NULL DEFAULT 'pending', owner TEXT, lease_until REAL, "
+                                'attempts INTEGER NOT NULL DEFAULT 0, merged INTEGER NOT NULL DEFAULT 0)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                                'id INTEGER PRIMARY KEY, task_id INTEGER NOT NULL, attempt INTEGER NOT NULL, '
+                                'items TEXT NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_task ON results (task_id, attempt)')
+
+    def _transaction(self, statements):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(self.connection)
+                self.connection.execute('COMMIT')
+                return result
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def seed(self, keys):
+        rows = [(json.dumps(key),) for key in keys]
+        self._transaction(lambda db: db.executemany('INSERT OR IGNORE INTO tasks (child) VALUES (?)', rows))
+        return len(rows)
+
+    def lease(self, owner, ttl=LEASE_TTL):
+        def statements(db):
+            now = time.time()
+            expired = db.execute("UPDATE tasks SET state = 'failed', owner = NULL, lease_until = NULL "
+                                 "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+            if expired.rowcount:
+                logger.warning(f'{expired.rowcount} expired tasks used up their {MAX_ATTEMPTS} attempts, marking failed')
+            row = db.execute("SELECT id, child, attempts FROM tasks WHERE state = 'pending' "
+                             "OR (state = 'leased' AND lease_until < ?) ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            task_id, child, attempts = row
+            db.execute("UPDATE tasks SET state = 'leased', owner = ?, lease_until = ?, attempts = ? WHERE id = ?",
+                       (owner, now + ttl, attempts + 1, task_id))
+            return task_id, attempts + 1, tuple(json.loads(child))
+        return self._transaction(statements)
+
+    def heartbeat(self, task_id, owner, ttl=LEASE_TTL):
+        def statements(db):
+            cursor = db.execute("UPDATE tasks SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                                (time.time() + ttl, task_id, owner))
+            return cursor.rowcount == 1
+        return self._transaction(statements)
+
+    def add_result(self, task_id, attempt, items):
+        self._transaction(lambda db: db.execute('INSERT INTO results (task_id, attempt, items) VALUES (?, ?, ?)',
+                                                (task_id, attempt, json.dumps(items))))
+
+    def complete(self, task_id, owner, attempt):
+        def statements(db):
+            cursor = db.execute("UPDATE tasks SET state = 'done', lease_until = NULL "
+                                "WHERE id = ? AND owner = ? AND attempts = ? AND state = 'leased'",
+                                (task_id, owner, attempt))
+            return cursor.rowcount == 1
+        return self._transaction(statements)
+
+    def fail(self, task_id, owner, attempt):
+        def statements(db):
+            db.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                       "owner = NULL, lease_until = NULL WHERE id = ? AND owner = ? AND attempts = ? AND state = 'leased'",
+                       (MAX_ATTEMPTS, task_id, owner, attempt))
+        self._transaction(statements)
+
+    def unfinished(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM tasks WHERE state IN ('pending', 'leased')").fetchone()[0]
+
+    def unmerged(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM tasks WHERE state = 'done' AND merged = 0").fetchone()[0]
+
+    def merge(self):
+        with self.lock:
+            tasks = self.connection.execute("SELECT id, attempts FROM tasks WHERE state = 'done' AND merged = 0 "
+                                            'ORDER BY id').fetchall()
+        for task_id, attempt in tasks:
+            with self.lock:
+                rows = self.connection.execute('SELECT items FROM results WHERE task_id = ? AND attempt = ? ORDER BY id',
+                                               (task_id, attempt)).fetchall()
+            for items, in rows:
+                yield json.loads(items)
+            self._transaction(lambda db: db.execute('UPDATE tasks SET merged = 1 WHERE id = ?', (task_id,)))
+
+    def summary(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall()
+        return ', '.join(f'{count} {state}' for state, count in rows)
+
+    def close(self):
+        self.connection.close()
+
+
+def worker_command(argv, path):
+    command = [sys.executable, argv[0], '-worker', path]
+    skip = False
+    for token in argv[1:]:
+        if skip:
+            skip = False
+        elif token.split('=', 1)[0] in COORDINATOR_ARGS:
+            skip = '=' not in token
+        else:
+            command.append(token)
+    return command
+
+
+class Coordinator:
+
+    def __init__(self, path, handler, spawn=0):
+        self.queue = WorkQueue(path)
+        self.handler = handler
+        self.spawn = spawn
+        self.processes = []
+
+    def chunks(self):
+        seeded = self.queue.seed(child_key(leaf.args) for leaf in self.handler.leaves())
+        logger.info(f'Seeded {seeded} children into {self.queue.path}: {self.queue.summary()}')
+        try:
+            for _ in range(self.spawn):
+                self.processes.append(subprocess.Popen(worker_command(sys.argv, self.queue.path)))
+            while True:
+                yield from self.queue.merge()
+                if self.queue.unfinished() == 0 and self.queue.unmerged() == 0:
+                    break
+                if self.processes and all(process.poll() is not None for process in self.processes):
+                    logger.error(f'Every spawned worker has exited with unfinished children: {self.queue.summary()}')
+                    yield from self.queue.merge()
+                    break
+                time.sleep(POLL_INTERVAL)
+            logger.info(f'Distributed crawl finished: {self.queue.summary()}')
+        finally:
+            for process in self.processes:
+                if process.poll() is None:
+                    process.terminate()
+                process.wait()
+            self.queue.close()
+
+
+class Worker:
+
+    def __init__(self, path, args, context):
+        self.queue = WorkQueue(path)
+        self.args = args
+        self.context = context
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+
+    def _heartbeat(self, task_id, stop, lost):
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            if not self.queue.heartbeat(task_id, self.owner):
+                logger.warning(f'Lost the lease on task {task_id}')
+                lost.set()
+                return
+
+    def _run_task(self, task_id, attempt, key):
+        db, category, subcategory, child = key
+        command_args = {**self.args, 'db': db, 'category': category, 'subcategory': subcategory, 'child': child}
+        handler = ChildCommandHandler(command_args, self.context)
+        stop, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task_id, stop, lost), daemon=True)
+        heartbeat.start()
+        try:
+            chunks = handler.process_async() if self.args['use_async'] else handler.process()
+            for chunk in chunks:
+                if lost.is_set():
+                    chunks.close()
+                    return
+                if chunk:
+                    self.queue.add_result(task_id, attempt, chunk)
+        except Exception:
+            logger.exception(f'Task {task_id} {key} failed')
+            self.queue.fail(task_id, self.owner, attempt)
+            return
+        finally:
+            stop.set()
+            heartbeat.join()
+        if handler.failed:
+            self.queue.fail(task_id, self.owner, attempt)
+        elif not self.queue.complete(task_id, self.owner, attempt):
+            logger.warning(f'Task {task_id} was taken over by another worker, dropping its results')
+
+    def run(self):
+        logger.info(f'Worker {self.owner} polling {self.queue.path}')
+        try:
+            while True:
+                task = self.queue.lease(self.owner)
+                if task is None:
+                    if self.queue.unfinished() == 0:
+                        break
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                task_id, attempt, key = task
+                logger.info(f'Worker {self.owner} leased task {task_id} {key} (attempt {attempt})')
+                self._run_task(task_id, attempt, key)
+        finally:
+            self.queue.close()
@@ -1,2 +1,18 @@
 class InvalidArgsException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class HTTPStatusException(Exception):
+
+    def __init__(self, url, status, retry_after=None):
+        super(HTTPStatusException, self).__init__(f'{url} responded with status {status}')
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ArchiveMissException(Exception):
+
+    def __init__(self, url):
+        super(ArchiveMissException, self).__init__(f'{url} is not in the replay archive')
+        self.url = url
\ No newline at end of file
@@ -0,0 +1,68 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or 'https').lower()
+    host, _, port = parts.netloc.lower().partition(':')
+    netloc = host if not port or DEFAULT_PORTS.get(scheme) == port else f'{host}:{port}'
+    path = parts.path.rstrip('/') or '/'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def url_digest(url):
+    return hashlib.blake2b(normalize_url(url).encode('utf-8'), digest_size=8).digest()
+
+
+class UrlFrontier:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.children = []
+        self.child_ids = {}
+        self.duplicates = 0
+
+    def _child_id(self, key):
+        if key not in self.child_ids:
+            self.child_ids[key] = len(self.children)
+            self.children.append(key)
+        return self.child_ids[key]
+
+    def claim(self, url, key):
+        digest = url_digest(url)
+        with self.lock:
+            child_id = self._child_id(key)
+            entry = self.entries.get(digest)
+            if entry is None:
+                self.entries[digest] = [url, True, child_id]
+                return True
+            if child_id not in entry[2:]:
+                entry.append(child_id)
+            if entry[1]:
+                self.duplicates += 1
+                return False
+            entry[1] = True
+            return True
+
+    def release(self, url):
+        with self.lock:
+            entry = self.entries.get(url_digest(url))
+            if entry is not None:
+                entry[1] = False
+
+    def memberships(self):
+        with self.lock:
+            for entry in self.entries.values():
+                yield entry[0], [self.children[child_id] for child_id in entry[2:]]
+
+    def summary(self):
+        return f'{len(self.entries)} unique products, {self.duplicates} duplicate fetches avoided'
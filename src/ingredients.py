@@ -0,0 +1,136 @@
+from columns import *
+from json_handler import read_items
+import argparse
+import json
+import threading
+
+INGREDIENT_SEPARATOR = ', '
+CHEMICAL_FIELDS = ['ingredient', 'concern', EWG_SCORE]
+
+
+class Ingredient:
+
+    __slots__ = ('id', 'name', 'products')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.products = set()
+
+
+class IngredientRegistry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ingredients = []
+        self.ingredient_ids = {}
+        self.folded = {}
+        self.concerns = []
+        self.concern_ids = {}
+        self.products = []
+        self.product_ids = {}
+
+    @classmethod
+    def load(cls, path):
+        registry = cls()
+        with open(path) as json_file:
+            table = json.load(json_file)
+        for entry in table['ingredients']:
+            registry._ingredient(entry['name']).products.update(entry['products'])
+        for concern in table['concerns']:
+            registry._concern_id(concern)
+        for url in table['products']:
+            registry._product_id(url)
+        return registry
+
+    def _ingredient(self, name):
+        ingredient_id = self.ingredient_ids.get(name)
+        if ingredient_id is None:
+            ingredient_id = self.ingredient_ids[name] = len(self.ingredients)
+            self.ingredients.append(Ingredient(ingredient_id, name))
+            self.folded.setdefault(name.casefold(), []).append(ingredient_id)
+        return self.ingredients[ingredient_id]
+
+    def _concern_id(self, concern):
+        if concern is None:
+            return None
+        concern_id = self.concern_ids.get(concern)
+        if concern_id is None:
+            concern_id = self.concern_ids[concern] = len(self.concerns)
+            self.concerns.append(concern)
+        return concern_id
+
+    def _product_id(self, url):
+        product_id = self.product_ids.get(url)
+        if product_id is None:
+            product_id = self.product_ids[url] = len(self.products)
+            self.products.append(url)
+        return product_id
+
+    def _ingredient_id(self, name, product_id):
+        if name is None:
+            return None
+        ingredient = self._ingredient(name)
+        ingredient.products.add(product_id)
+        return ingredient.id
+
+    def compact(self, data):
+        with self.lock:
+            product_id = self._product_id(data[URL])
+            chemicals = [
+                [self._ingredient_id(chemical.get(NAME), product_id), self._concern_id(chemical.get(CONCERNS)),
+                 chemical.get(EWG_SCORE)]
+                for chemical in data.get(CHEMICALS) or []
+            ]
+            ingredients = data.get(LIST_OF_INGREDIENTS)
+            if ingredients:
+                ingredients = [self._ingredient_id(name, product_id)
+                               for name in ingredients.split(INGREDIENT_SEPARATOR)]
+        return {**data, CHEMICALS: chemicals, LIST_OF_INGREDIENTS: ingredients}
+
+    def expand(self, data):
+        ingredients = data.get(LIST_OF_INGREDIENTS)
+        if isinstance(ingredients, list):
+            ingredients = INGREDIENT_SEPARATOR.join(self.ingredients[ingredient_id].name for ingredient_id in ingredients)
+        chemicals = [
+            {NAME: self.ingredients[ingredient_id].name if ingredient_id is not None else None,
+             CONCERNS: self.concerns[concern_id] if concern_id is not None else None,
+             EWG_SCORE: score}
+            for ingredient_id, concern_id, score in data.get(CHEMICALS) or []
+        ]
+        return {**data, CHEMICALS: chemicals, LIST_OF_INGREDIENTS: ingredients}
+
+    def products_containing(self, name):
+        with self.lock:
+            ingredient_ids = self.folded.get(name.casefold(), [])
+            return {self.products[product_id]
+                    for ingredient_id in ingredient_ids
+                    for product_id in self.ingredients[ingredient_id].products}
+
+    def write(self, path):
+        with self.lock, open(path, 'w') as json_file:
+            json_file.write(f'{{"chemical_fields": {json.dumps(CHEMICAL_FIELDS)}, "ingredients": [')
+            for ingredient in self.ingredients:
+                if ingredient.id:
+                    json_file.write(', ')
+                json_file.write(json.dumps({'id': ingredient.id, 'name': ingredient.name,
+                                            'products': sorted(ingredient.products)}))
+            json_file.write(f'], "concerns": {json.dumps(self.concerns)}, "products": {json.dumps(self.products)}}}')
+
+    def summary(self):
+        return f'{len(self.ingredients)} ingredients, {len(self.concerns)} concerns across {len(self.products)} products'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query an ingredients table written with -ingredients.')
+    parser.add_argument('table', type=str)
+    parser.add_argument('-ingredient', type=str, help='print urls of products containing this ingredient')
+    parser.add_argument('-expand', type=str, help='print the items of a compacted results file as ndjson')
+    args = vars(parser.parse_args())
+    registry = IngredientRegistry.load(args['table'])
+    if args['ingredient'] is not None:
+        for url in sorted(registry.products_containing(args['ingredient'])):
+            print(url)
+    if args['expand'] is not None:
+        for data in read_items(args['expand']):
+            print(json.dumps(registry.expand(data)))
@@ -1,8 +1,221 @@
 from datetime import datetime
+from exception import InvalidArgsException
+import json
 import os
+import re
+import shutil
+import time
 
+FSYNC_INTERVAL = 5
+FORMATS = ['json', 'ndjson', 'parquet']
+READ_SIZE = 1 << 16
+WHITESPACE = re.compile(r'\s*')
 
-def create_json():
-    filename = f'results_{datetime.now()}.json'
-    new_file = open(f'{os.getcwd()}/links/{filename}', 'w')
-    return new_file
+
+def results_path(created, postfix='', extension='json'):
+    filename = f'results_{created}{postfix}.{extension}'
+    return f'{os.getcwd()}/links/{filename}'
+
+
+class JsonArrayFile:
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.file.write('[')
+        self.empty = True
+
+    def append(self, data):
+        if not self.empty:
+            self.file.write(', ')
+        self.file.write(json.dumps(data))
+        self.empty = False
+
+    def close(self):
+        self.file.write(']')
+        self.file.close()
+
+
+class JsonStream:
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ''
+        self.position = 0
+
+    def _fill(self):
+        data = self.file.read(READ_SIZE)
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+        return bool(data)
+
+    def peek(self):
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f'Expected one of {chars!r} in {self.file.name}, got {char!r}')
+        self.position += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, self.position = self.decoder.raw_decode(self.buffer, self.position)
+                return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    def array(self):
+        if self.peek() == ']':
+            self.position += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def read_items(path):
+    with open(path) as results_file:
+        if path.endswith('.ndjson'):
+            for line in results_file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        stream = JsonStream(results_file)
+        if stream.expect('[{') == '[':
+            yield from stream.array()
+            return
+        if stream.peek() == '}':
+            return
+        while True:
+            stream.value()
+            stream.expect(':')
+            stream.expect('[')
+            yield from stream.array()
+            if stream.expect(',}') == '}':
+                return
+
+
+class ResultsWriter:
+
+    def __init__(self, ingredients=None):
+        self.created = datetime.now()
+        self.count = 0
+        self.synced_at = time.monotonic()
+        self.ingredients = ingredients
+
+    def _files(self):
+        return []
+
+    def _write_item(self, data):
+        pass
+
+    def write(self, chunk):
+        for data in chunk:
+            if self.ingredients is not None:
+                data = self.ingredients.compact(data)
+            self._write_item(data)
+            self.count += 1
+        if time.monotonic() - self.synced_at >= FSYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        for stream in self._files():
+            stream.flush()
+            os.fsync(stream.fileno())
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        if self.ingredients is not None:
+            self.ingredients.write(results_path(self.created, '_ingredients'))
+
+
+class NdjsonWriter(ResultsWriter):
+
+    def __init__(self, db_names, split=False, ingredients=None):
+        super(NdjsonWriter, self).__init__(ingredients)
+        if split:
+            self.files = {db: open(results_path(self.created, f'_{db}', 'ndjson'), 'w') for db in db_names}
+        else:
+            results_file = open(results_path(self.created, extension='ndjson'), 'w')
+            self.files = {db: results_file for db in db_names}
+
+    def _files(self):
+        return set(self.files.values())
+
+    def _write_item(self, data):
+        self.files[data['db']].write(json.dumps(data) + '\n')
+
+    def close(self):
+        for stream in self._files():
+            stream.close()
+        super(NdjsonWriter, self).close()
+
+
+class JsonWriter(ResultsWriter):
+
+    def __init__(self, db_names, split=False, ingredients=None):
+        super(JsonWriter, self).__init__(ingredients)
+        self.split = split
+        self.path = results_path(self.created)
+        if split:
+            self.arrays = {db: JsonArrayFile(results_path(self.created, f'_{db}')) for db in db_names}
+        else:
+            self.arrays = {db: JsonArrayFile(f'{self.path}.{db}.part') for db in db_names}
+
+    def _files(self):
+        return [array.file for array in self.arrays.values()]
+
+    def _write_item(self, data):
+        self.arrays[data['db']].append(data)
+
+    def close(self):
+        for array in self.arrays.values():
+            array.close()
+        super(JsonWriter, self).close()
+        if self.split:
+            return
+        with open(self.path, 'w') as json_file:
+            json_file.write('{')
+            for index, (db, array) in enumerate(self.arrays.items()):
+                if index:
+                    json_file.write(', ')
+                json_file.write(f'{json.dumps(db)}: ')
+                with open(array.file.name) as part:
+                    shutil.copyfileobj(part, json_file)
+                os.remove(array.file.name)
+            json_file.write('}')
+
+
+def write_memberships(created, memberships):
+    with open(results_path(created, '_categories'), 'w') as json_file:
+        json_file.write('{')
+        for index, (url, children) in enumerate(memberships):
+            if index:
+                json_file.write(', ')
+            json_file.write(f'{json.dumps(url)}: {json.dumps(children)}')
+        json_file.write('}')
+
+
+def create_writer(db_names, format='json', split=False, ingredients=None):
+    if format == 'parquet':
+        if ingredients is not None:
+            raise InvalidArgsException('ingredients can not be used with parquet format, it is already normalized!')
+        if split:
+            raise InvalidArgsException('split can not be used with parquet format, its tables have a db column!')
+        from parquet_handler import ParquetWriter
+        return ParquetWriter(db_names)
+    if format == 'ndjson':
+        return NdjsonWriter(db_names, split, ingredients)
+    return JsonWriter(db_names, split, ingredients)
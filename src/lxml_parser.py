@@ -0,0 +1,103 @@
+from functools import lru_cache
+from lxml import etree
+from lxml import html as lxml_html
+from lxml.cssselect import CSSSelector
+
+SKIPPED_TAGS = {'script', 'style', 'template'}
+EMPTY_DOCUMENT = '<html></html>'
+
+
+@lru_cache(maxsize=None)
+def compile_selector(selector):
+    return CSSSelector(selector, translator='html')
+
+
+def _collect_text(element, parts):
+    if not isinstance(element.tag, str) or element.tag in SKIPPED_TAGS:
+        return
+    if element.text:
+        parts.append(element.text)
+    for child in element:
+        _collect_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+
+class LxmlNode:
+
+    __slots__ = ('element',)
+
+    def __init__(self, element):
+        self.element = element
+
+    def __getitem__(self, name):
+        value = self.element.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __bool__(self):
+        return True
+
+    def get(self, name, default=None):
+        return self.element.get(name, default)
+
+    @property
+    def text(self):
+        parts = []
+        _collect_text(self.element, parts)
+        return ''.join(parts)
+
+    def _matches(self, selector):
+        return [element for element in compile_selector(selector)(self.element) if element is not self.element]
+
+    def select(self, selector):
+        return [LxmlNode(element) for element in self._matches(selector)]
+
+    def select_one(self, selector):
+        matches = self._matches(selector)
+        return LxmlNode(matches[0]) if matches else None
+
+    def _descendants(self, name):
+        return self.element.iterdescendants(name)
+
+    def find(self, name, attrs=None):
+        for element in self._descendants(name):
+            if all(self._attr_matches(element.get(key), expected) for key, expected in (attrs or {}).items()):
+                return LxmlNode(element)
+        return None
+
+    def find_parent(self, name, class_=None):
+        for element in self.element.iterancestors(name):
+            if class_ is None or class_ in element.get('class', '').split():
+                return LxmlNode(element)
+        return None
+
+    @staticmethod
+    def _attr_matches(value, expected):
+        if value is None:
+            return False
+        if hasattr(expected, 'search'):
+            return expected.search(value) is not None
+        return value == expected
+
+
+class LxmlDocument(LxmlNode):
+
+    __slots__ = ()
+
+    def __init__(self, html):
+        try:
+            try:
+                root = lxml_html.document_fromstring(html)
+            except ValueError:
+                root = lxml_html.document_fromstring(html.encode('utf-8'))
+        except etree.ParserError:
+            root = lxml_html.document_fromstring(EMPTY_DOCUMENT)
+        super(LxmlDocument, self).__init__(root.getroottree().getroot())
+
+    def _matches(self, selector):
+        return compile_selector(selector)(self.element)
+
+    def _descendants(self, name):
+        return self.element.iter(name)
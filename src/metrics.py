@@ -0,0 +1,221 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+EXPORT_INTERVAL = 15
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Metric:
+
+    TYPE = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.TYPE}']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(labels)} {value}')
+        return lines
+
+
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+
+class Gauge(Metric):
+
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, description, buckets):
+        super(Histogram, self).__init__(name, description)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.TYPE}']
+        with self.lock:
+            for labels, (counts, count, total) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", bound),))} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(labels)} {total}')
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.started = time.time()
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, description):
+        return self._register(Counter(name, description))
+
+    def gauge(self, name, description):
+        return self._register(Gauge(name, description))
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, description, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(tmp_path, path)
+
+
+registry = Registry()
+
+REQUESTS = registry.counter('ewg_requests_total', 'HTTP responses by host and status')
+REQUEST_ERRORS = registry.counter('ewg_request_errors_total', 'Requests that failed without a response')
+RETRIES = registry.counter('ewg_retries_total', 'Retried requests by reason')
+CACHE_HITS = registry.counter('ewg_cache_hits_total', 'Responses served from the cache by outcome')
+RESPONSE_BYTES = registry.counter('ewg_response_bytes_total', 'Response bytes on the wire and decoded')
+FETCH_SECONDS = registry.histogram('ewg_fetch_seconds', 'Fetch latency by host')
+PARSE_SECONDS = registry.histogram('ewg_parse_seconds', 'Parse time by scraper method', PARSE_BUCKETS)
+ITEMS = registry.counter('ewg_items_total', 'Scraped items by database')
+QUEUE_DEPTH = registry.gauge('ewg_queue_depth', 'Items waiting in internal queues')
+IN_FLIGHT = registry.gauge('ewg_in_flight', 'Work currently in progress by stage')
+START_TIME = registry.gauge('ewg_start_time_seconds', 'Unix time the crawl started')
+START_TIME.set(registry.started)
+
+
+def record_timings(timings):
+    for method, elapsed in timings:
+        PARSE_SECONDS.observe(elapsed, method=method)
+
+
+def summary():
+    elapsed = max(time.time() - registry.started, 1e-9)
+    return f'{REQUESTS.total() / elapsed:.2f} requests/s, {ITEMS.total() / elapsed * 60:.1f} items/min, ' \
+           f'{RETRIES.total()} retries, {REQUEST_ERRORS.total()} request errors'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class MetricsExporter:
+
+    def __init__(self, path=None, port=None, interval=EXPORT_INTERVAL):
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.stop = threading.Event()
+        self.thread = None
+        self.server = None
+
+    def start(self):
+        if self.port is not None:
+            self.server = ThreadingHTTPServer(('', self.port), MetricsHandler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            logger.info(f'Serving metrics on http://localhost:{self.server.server_port}/metrics')
+        if self.path is not None:
+            self.thread = threading.Thread(target=self._export, daemon=True)
+            self.thread.start()
+        return self
+
+    def _export(self):
+        while not self.stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            registry.write(self.path)
+        except OSError:
+            logger.exception(f"Couldn't write metrics to {self.path}")
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -1,26 +1,226 @@
+from requests.adapters import HTTPAdapter
+from cache import ResponseCache, CACHE_TTL, CACHE_SIZE
+from exception import HTTPStatusException
+from ratelimit import AdaptiveRateLimiter, CircuitBreaker, RetryPolicy, parse_retry_after, THROTTLE_STATUSES
+from proxies import ProxyPool, BAN_STATUSES
+from archive import ArchiveRecorder, ArchiveReplayer
+from metrics import REQUESTS, REQUEST_ERRORS, RETRIES, CACHE_HITS, RESPONSE_BYTES, FETCH_SECONDS
+from urllib.parse import urlparse
+import importlib.util
+import random
 import requests
+import threading
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+ACCEPT_ENCODING = 'gzip, deflate, br' if importlib.util.find_spec('brotli') is not None else 'gzip, deflate'
+
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/71.0.3578.98 ' \
-                  'Safari/537.36 '
+                  'Safari/537.36 ',
+    'Accept-Encoding': ACCEPT_ENCODING
 }
 
+USER_AGENTS = [
+    HEADERS['User-Agent'],
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 '
+    'Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 '
+    'Safari/605.1.15',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
+    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 '
+    'Safari/537.36'
+]
+
 ATTEMPTS = 4
-SLEEP = 5
 TIMEOUT = 80
+DELAY = 3
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+
+
+class TransferStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.wire_bytes = 0
+        self.body_bytes = 0
+        self.elapsed = 0.0
+
+    def record(self, url, wire_bytes, body_bytes, elapsed):
+        with self.lock:
+            self.requests += 1
+            self.wire_bytes += wire_bytes
+            self.body_bytes += body_bytes
+            self.elapsed += elapsed
+        RESPONSE_BYTES.inc(wire_bytes, kind='wire')
+        RESPONSE_BYTES.inc(body_bytes, kind='decoded')
+        FETCH_SECONDS.observe(elapsed, host=urlparse(url).netloc)
+        logger.debug(f'Fetched {url}: {wire_bytes} bytes on the wire, {body_bytes} bytes decoded in {elapsed:.3f}s')
+
+    def summary(self):
+        with self.lock:
+            average = self.elapsed / self.requests if self.requests else 0.0
+            return f'{self.requests} requests, {self.wire_bytes} bytes on the wire, ' \
+                   f'{self.body_bytes} bytes decoded, {average:.3f}s average latency'
+
+
+def create_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def configure_cache(directory, ttl=CACHE_TTL, max_size=CACHE_SIZE):
+    global cache
+    cache = ResponseCache(directory, ttl, max_size)
+
+
+def configure_archive(record=None, replay=None):
+    global recorder, replayer
+    if record is not None:
+        recorder = ArchiveRecorder(record)
+    if replay is not None:
+        replayer = ArchiveReplayer(replay)
+
+
+def close_archive():
+    for archive in (recorder, replayer):
+        if archive is not None:
+            archive.close()
+
+
+def configure_proxies(source):
+    global proxy_pool
+    proxy_pool = ProxyPool.from_source(source)
+
+
+def configure_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+    global session
+    session.close()
+    session = create_session(pool_connections, pool_maxsize)
+
+
+def delay_to_rate(delay):
+    return 1 / delay if delay > 0 else None
+
+
+limiter = AdaptiveRateLimiter(delay_to_rate(DELAY))
+breaker = CircuitBreaker()
+retry_policy = RetryPolicy()
+stats = TransferStats()
+session = create_session()
+cache = None
+proxy_pool = None
+recorder = None
+replayer = None
+
+
+def check_status(url, status, headers, route=None):
+    REQUESTS.inc(host=urlparse(url).netloc, status=status)
+    retry_after = parse_retry_after(headers.get('Retry-After'))
+    if status in THROTTLE_STATUSES:
+        limiter.on_throttle(url, retry_after, route)
+    if status < 500 and status != 429:
+        breaker.record_success(url)
+    if status >= 400:
+        raise HTTPStatusException(url, status, retry_after)
+    limiter.on_success(url, route)
+
+
+def acquire_route():
+    proxy = proxy_pool.acquire() if proxy_pool is not None else None
+    return proxy, (proxy.url if proxy is not None else None)
+
+
+def release_route(url, proxy, latency=None, status=None, error=False):
+    if error:
+        REQUEST_ERRORS.inc(host=urlparse(url).netloc)
+    if proxy is None:
+        return
+    proxy_pool.release(proxy, latency, error or status in BAN_STATUSES)
+
+
+def request_headers(entry, proxy):
+    headers = cache.conditional_headers(entry) if entry is not None else {}
+    if proxy is not None:
+        headers['User-Agent'] = random.choice(USER_AGENTS)
+    return headers
+
+
+def counts_against_host(error):
+    if isinstance(error, HTTPStatusException):
+        return error.status >= 500 or error.status == 429
+    return proxy_pool is None
+
+
+def retry_reason(error):
+    if isinstance(error, HTTPStatusException):
+        return str(error.status)
+    return type(error).__name__
 
 
 def get_html_by_url(url, attempts=ATTEMPTS):
+    if replayer is not None:
+        return replayer.get(url)
+    html = _fetch_html(url, attempts)
+    if recorder is not None:
+        recorder.record(url, html)
+    return html
+
+
+def _fetch_html(url, attempts):
+    entry = cache.get(url) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        logger.debug(f'Cache hit {url}')
+        CACHE_HITS.inc(outcome='fresh')
+        return entry['body']
+    attempt = 0
+    while True:
+        try:
+            return _request_html(url, entry)
+        except Exception as e:
+            if attempt >= attempts or not retry_policy.should_retry(e):
+                if counts_against_host(e):
+                    breaker.record_failure(url)
+                raise
+            delay = retry_policy.backoff(attempt, e)
+            attempt += 1
+            RETRIES.inc(reason=retry_reason(e))
+            logger.debug(f'Something went wrong ({e}), try request again {url} in {delay:.1f} seconds.')
+            time.sleep(delay)
+
+
+def _request_html(url, entry):
+    breaker.wait(url)
+    proxy, route = acquire_route()
+    limiter.wait(url, route)
+    started = time.monotonic()
     try:
-        response = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
-        return response.text
-    except Exception as e:
-        if attempts > 0:
-            logger.debug(f'Something went wrong, try request again {url} in {SLEEP} seconds.')
-            time.sleep(SLEEP)
-            return get_html_by_url(url, attempts=attempts-1) 
-        raise e
+        response = session.get(url, headers=request_headers(entry, proxy), timeout=TIMEOUT,
+                               proxies=proxy.proxies if proxy is not None else None)
+        body = response.content
+    except Exception:
+        release_route(url, proxy, error=True)
+        raise
+    elapsed = time.monotonic() - started
+    release_route(url, proxy, elapsed, response.status_code)
+    wire_bytes = response.raw.tell() or len(body)
+    stats.record(url, wire_bytes, len(body), elapsed)
+    check_status(url, response.status_code, response.headers, route)
+    if entry is not None and response.status_code == 304:
+        logger.debug(f'Cache revalidated {url}')
+        CACHE_HITS.inc(outcome='revalidated')
+        cache.revalidated(url, entry)
+        return entry['body']
+    html = response.text
+    if cache is not None and response.status_code == 200:
+        cache.put(url, html, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return html
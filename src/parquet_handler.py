@@ -0,0 +1,95 @@
+from columns import *
+from exception import InvalidArgsException
+from json_handler import ResultsWriter, results_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+BATCH_SIZE = 1000
+SECTIONS = [SKIN_DEEP, CLEANING]
+
+
+def _schemas():
+    text = pa.string()
+    category = pa.dictionary(pa.int32(), pa.string())
+    return {
+        'products': pa.schema([
+            (URL, text),
+            (DB, category),
+            (TERA_CATEGORY, category),
+            (BRAND, category),
+            (PRODUCT_NAME, text),
+            (EWG_SCORE, text),
+            (UPC_CODE, text),
+            (LIST_OF_INGREDIENTS, text)
+        ]),
+        'product_chemicals': pa.schema([
+            (URL, text),
+            (NAME, text),
+            (CONCERNS, text),
+            (EWG_SCORE, text)
+        ]),
+        'concerns': pa.schema([
+            (URL, text),
+            (SECTION, category),
+            (NAME, category),
+            (LEVEL, category)
+        ])
+    }
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+class ParquetWriter(ResultsWriter):
+
+    def __init__(self, db_names):
+        if pa is None:
+            raise InvalidArgsException('pyarrow should be installed if you want to use parquet format!')
+        super(ParquetWriter, self).__init__()
+        self.schemas = _schemas()
+        self.rows = {table: [] for table in self.schemas}
+        self.writers = {
+            table: pq.ParquetWriter(results_path(self.created, f'_{table}', 'parquet'), schema)
+            for table, schema in self.schemas.items()
+        }
+
+    def _write_item(self, data):
+        url = data[URL]
+        self.rows['products'].append({
+            URL: url,
+            DB: data[DB],
+            TERA_CATEGORY: data.get(TERA_CATEGORY),
+            BRAND: data.get(BRAND),
+            PRODUCT_NAME: data.get(PRODUCT_NAME),
+            EWG_SCORE: _text(data.get(EWG_SCORE)),
+            UPC_CODE: data.get(UPC_CODE),
+            LIST_OF_INGREDIENTS: data.get(LIST_OF_INGREDIENTS)
+        })
+        for chemical in data.get(CHEMICALS) or []:
+            self.rows['product_chemicals'].append({
+                URL: url,
+                NAME: chemical.get(NAME),
+                CONCERNS: chemical.get(CONCERNS),
+                EWG_SCORE: _text(chemical.get(EWG_SCORE))
+            })
+        for section in SECTIONS:
+            for name, level in (data.get(section) or {}).items():
+                self.rows['concerns'].append({URL: url, SECTION: section, NAME: name, LEVEL: level})
+        if len(self.rows['products']) >= BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        for table, rows in self.rows.items():
+            if rows:
+                self.writers[table].write_table(pa.Table.from_pylist(rows, schema=self.schemas[table]))
+                rows.clear()
+
+    def close(self):
+        self._flush()
+        for writer in self.writers.values():
+            writer.close()
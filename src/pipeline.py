@@ -0,0 +1,214 @@
+import asyncio
+import queue
+import threading
+from metrics import QUEUE_DEPTH
+
+PREFETCH = 1
+POLL_INTERVAL = 0.5
+
+DONE = object()
+
+
+def prefetch(iterable, depth=PREFETCH):
+    if depth <= 0:
+        yield from iterable
+        return
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(entry):
+        QUEUE_DEPTH.inc(queue='prefetch')
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        QUEUE_DEPTH.dec(queue='prefetch')
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((DONE, None))
+        except Exception as e:
+            put((DONE, e))
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            QUEUE_DEPTH.dec(queue='prefetch')
+            if error is not None:
+                raise error
+            if item is DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+        while not buffer.empty():
+            buffer.get_nowait()
+            QUEUE_DEPTH.dec(queue='prefetch')
+
+
+async def aprefetch(agen, depth=PREFETCH):
+    if depth <= 0:
+        async for item in agen:
+            yield item
+        return
+    buffer = asyncio.Queue(maxsize=depth)
+
+    async def produce():
+        try:
+            async for item in agen:
+                QUEUE_DEPTH.inc(queue='prefetch')
+                await buffer.put((item, None))
+            await buffer.put((DONE, None))
+        except Exception as e:
+            await buffer.put((DONE, e))
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item, error = await buffer.get()
+            if item is not DONE:
+                QUEUE_DEPTH.dec(queue='prefetch')
+            if error is not None:
+                raise error
+            if item is DONE:
+                return
+            yield item
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        while not buffer.empty():
+            item, _ = buffer.get_nowait()
+            if item is not DONE:
+                QUEUE_DEPTH.dec(queue='prefetch')
+        await agen.aclose()
+
+
+ITEM, FINISHED, LAUNCHED, ERROR = range(4)
+
+
+def interleave(iterables, parallel):
+    output = queue.Queue()
+    stop = threading.Event()
+    slots = threading.Semaphore(parallel)
+    threads = []
+
+    def drain(iterable, turn):
+        try:
+            for item in iterable:
+                output.put((ITEM, item, turn))
+                while not turn.acquire(timeout=POLL_INTERVAL):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+        except Exception as e:
+            output.put((ERROR, e, None))
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+            slots.release()
+            output.put((FINISHED, None, None))
+
+    def launch():
+        count = 0
+        try:
+            for iterable in iterables:
+                while not slots.acquire(timeout=POLL_INTERVAL):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    slots.release()
+                    return
+                thread = threading.Thread(target=drain, args=(iterable, threading.Semaphore(0)), daemon=True)
+                threads.append(thread)
+                thread.start()
+                count += 1
+        except Exception as e:
+            output.put((ERROR, e, None))
+        finally:
+            output.put((LAUNCHED, count, None))
+
+    launcher = threading.Thread(target=launch, daemon=True)
+    launcher.start()
+    total, finished = None, 0
+    try:
+        while total is None or finished < total:
+            kind, value, turn = output.get()
+            if kind == ITEM:
+                turn.release()
+                yield value
+            elif kind == FINISHED:
+                finished += 1
+            elif kind == LAUNCHED:
+                total = value
+            else:
+                raise value
+    finally:
+        stop.set()
+        launcher.join()
+        for thread in threads:
+            thread.join()
+
+
+async def ainterleave(agens, parallel):
+    output = asyncio.Queue()
+    slots = asyncio.Semaphore(parallel)
+    tasks = []
+
+    async def drain(agen, turn):
+        try:
+            async for item in agen:
+                await output.put((ITEM, item, turn))
+                await turn.acquire()
+        except Exception as e:
+            await output.put((ERROR, e, None))
+        finally:
+            await agen.aclose()
+            slots.release()
+            output.put_nowait((FINISHED, None, None))
+
+    async def launch():
+        count = 0
+        try:
+            for agen in agens:
+                await slots.acquire()
+                tasks.append(asyncio.ensure_future(drain(agen, asyncio.Semaphore(0))))
+                count += 1
+        except Exception as e:
+            await output.put((ERROR, e, None))
+        finally:
+            output.put_nowait((LAUNCHED, count, None))
+
+    tasks.append(asyncio.ensure_future(launch()))
+    total, finished = None, 0
+    try:
+        while total is None or finished < total:
+            kind, value, turn = await output.get()
+            if kind == ITEM:
+                turn.release()
+                yield value
+            elif kind == FINISHED:
+                finished += 1
+            elif kind == LAUNCHED:
+                total = value
+            else:
+                raise value
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,45 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+class ProductIndex:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS products ('
+                                'url TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, seen_at REAL NOT NULL)')
+        self.connection.commit()
+
+    def changed(self, entries):
+        urls = list(entries)
+        known = {}
+        with self.lock:
+            for start in range(0, len(urls), BATCH_SIZE):
+                batch = urls[start:start + BATCH_SIZE]
+                placeholders = ', '.join('?' * len(batch))
+                rows = self.connection.execute(
+                    f'SELECT url, fingerprint FROM products WHERE url IN ({placeholders}) AND seen_at < ?',
+                    batch + [self.started])
+                known.update(rows)
+        return [url for url in urls if known.get(url) != entries[url]]
+
+    def update(self, entries):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                'INSERT INTO products (url, fingerprint, seen_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET fingerprint = excluded.fingerprint, seen_at = excluded.seen_at',
+                [(url, fingerprint, now) for url, fingerprint in entries.items()])
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
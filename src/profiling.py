@@ -0,0 +1,78 @@
+from collections import Counter
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 25
+
+
+class Profiler:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.profile = cProfile.Profile()
+        self.thread_profiles = []
+
+    def start(self):
+        threading.setprofile(self._enable_in_thread)
+        self.profile.enable()
+        return self
+
+    def _enable_in_thread(self, frame, event, arg):
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append(profile)
+        profile.enable()
+
+    def close(self):
+        threading.setprofile(None)
+        self.profile.disable()
+        with self.lock:
+            stats = pstats.Stats(self.profile, *self.thread_profiles)
+        stats.dump_stats(self.path)
+        report = io.StringIO()
+        stats.stream = report
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        logger.info(f'Profile of {len(self.thread_profiles) + 1} threads written to {self.path}\n{report.getvalue()}')
+
+
+class Sampler:
+
+    def __init__(self, path, interval=SAMPLE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _sample(self):
+        while not self.stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        with open(self.path, 'w') as samples_file:
+            for stack, count in self.stacks.most_common():
+                samples_file.write(f'{stack} {count}\n')
+        logger.info(f'{sum(self.stacks.values())} stack samples written to {self.path}')
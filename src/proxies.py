@@ -0,0 +1,101 @@
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+LATENCY_ALPHA = 0.3
+MIN_REQUESTS = 5
+MAX_ERROR_RATE = 0.5
+MAX_LATENCY = 20
+BAN_STATUSES = {403, 407, 429}
+
+
+class Proxy:
+
+    __slots__ = ('url', 'latency', 'requests', 'errors', 'in_flight')
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = None
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+
+    @property
+    def proxies(self):
+        return {'http': self.url, 'https': self.url}
+
+    @property
+    def error_rate(self):
+        return self.errors / self.requests if self.requests else 0.0
+
+    def score(self):
+        latency = self.latency if self.latency is not None else 1.0
+        return latency * (1 + self.in_flight) * (1 + self.error_rate)
+
+    def is_healthy(self):
+        if self.requests < MIN_REQUESTS:
+            return True
+        return self.error_rate <= MAX_ERROR_RATE and (self.latency or 0) <= MAX_LATENCY
+
+
+def _normalize(proxy):
+    proxy = proxy.strip()
+    return proxy if '://' in proxy else f'http://{proxy}'
+
+
+class ProxyPool:
+
+    def __init__(self, proxies):
+        self.lock = threading.Lock()
+        self.proxies = [Proxy(_normalize(proxy)) for proxy in dict.fromkeys(proxies) if proxy.strip()]
+        logger.info(f'Proxy pool started with {len(self.proxies)} proxies')
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as proxies_file:
+            return cls([line for line in proxies_file if line.strip() and not line.startswith('#')])
+
+    @classmethod
+    def from_free_proxy(cls):
+        from fp.fp import FreeProxy
+        try:
+            return cls(FreeProxy().get_proxy_list())
+        except SystemExit:
+            logger.error("Couldn't download free proxy list")
+            return cls([])
+
+    @classmethod
+    def from_source(cls, source):
+        if source == 'free':
+            return cls.from_free_proxy()
+        return cls.from_file(source)
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def acquire(self):
+        with self.lock:
+            if not self.proxies:
+                return None
+            candidates = random.sample(self.proxies, min(2, len(self.proxies)))
+            proxy = min(candidates, key=Proxy.score)
+            proxy.in_flight += 1
+            return proxy
+
+    def release(self, proxy, latency=None, error=False):
+        with self.lock:
+            proxy.in_flight -= 1
+            proxy.requests += 1
+            if error:
+                proxy.errors += 1
+            elif latency is not None:
+                if proxy.latency is None:
+                    proxy.latency = latency
+                else:
+                    proxy.latency = LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * proxy.latency
+            if not proxy.is_healthy() and proxy in self.proxies:
+                self.proxies.remove(proxy)
+                logger.warning(f'Evicting proxy {proxy.url}: error rate {proxy.error_rate:.2f}, '
+                               f'latency {proxy.latency}, {len(self.proxies)} proxies left')
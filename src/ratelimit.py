@@ -0,0 +1,151 @@
+from email.utils import parsedate_to_datetime
+from exception import HTTPStatusException
+from urllib.parse import urlparse
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}
+BACKOFF_BASE = 1
+BACKOFF_CAP = 60
+MIN_RATE = 0.05
+RATE_INCREASE = 0.05
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return min(max(float(value), 0.0), BACKOFF_CAP)
+    except ValueError:
+        pass
+    try:
+        return min(max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0), BACKOFF_CAP)
+    except (TypeError, ValueError):
+        return None
+
+
+class HostBucket:
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+
+class AdaptiveRateLimiter:
+
+    def __init__(self, rate=None, max_rate=None):
+        self.lock = threading.Lock()
+        self.configure(rate, max_rate)
+
+    def configure(self, rate=None, max_rate=None):
+        with self.lock:
+            self.rate = rate
+            self.max_rate = max_rate or rate
+            self.buckets = {}
+
+    def _bucket(self, url, route=None):
+        key = (urlparse(url).netloc, route)
+        if key not in self.buckets:
+            self.buckets[key] = HostBucket(self.rate)
+        return self.buckets[key]
+
+    def reserve(self, url, route=None):
+        with self.lock:
+            bucket = self._bucket(url, route)
+            now = time.monotonic()
+            delay = max(bucket.paused_until - now, 0.0)
+            if bucket.rate is not None:
+                bucket.tokens = min(1.0, bucket.tokens + (now - bucket.updated) * bucket.rate)
+                bucket.updated = now
+                bucket.tokens -= 1.0
+                if bucket.tokens < 0:
+                    delay = max(delay, -bucket.tokens / bucket.rate)
+            return delay
+
+    def wait(self, url, route=None):
+        delay = self.reserve(url, route)
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self, url, route=None):
+        with self.lock:
+            bucket = self._bucket(url, route)
+            if bucket.rate is not None and self.max_rate is not None:
+                bucket.rate = min(self.max_rate, bucket.rate + RATE_INCREASE)
+
+    def on_throttle(self, url, retry_after=None, route=None):
+        with self.lock:
+            bucket = self._bucket(url, route)
+            if bucket.rate is not None:
+                bucket.rate = max(MIN_RATE, bucket.rate / 2)
+            if retry_after:
+                bucket.paused_until = max(bucket.paused_until, time.monotonic() + retry_after)
+            via = f' via {route}' if route else ''
+            logger.warning(f'{urlparse(url).netloc} is throttling us{via}, slowing down to {bucket.rate} requests/s')
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.opened_at = {}
+
+    def reserve(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            opened_at = self.opened_at.get(host)
+            if opened_at is None:
+                return 0.0
+            return max(opened_at + self.cooldown - time.monotonic(), 0.0)
+
+    def wait(self, url):
+        delay = self.reserve(url)
+        while delay > 0:
+            logger.debug(f'Circuit for {urlparse(url).netloc} is open, waiting {delay:.1f} seconds before {url}')
+            time.sleep(delay)
+            delay = self.reserve(url)
+
+    def record_success(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            self.failures[host] = 0
+            self.opened_at.pop(host, None)
+
+    def record_failure(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.threshold:
+                if host not in self.opened_at:
+                    logger.warning(f'{self.failures[host]} consecutive failures, opening circuit for {host}')
+                self.opened_at[host] = time.monotonic()
+
+
+class RetryPolicy:
+
+    def __init__(self, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+        self.base = base
+        self.cap = cap
+
+    def should_retry(self, error):
+        if isinstance(error, HTTPStatusException):
+            return error.status in RETRY_STATUSES
+        return True
+
+    def backoff(self, attempt, error):
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after:
+            return min(retry_after, self.cap)
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
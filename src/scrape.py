@@ -1,10 +1,25 @@
 import logging
 import argparse
 from commands import CommandHandlerFactory
-from json_handler import create_json
+from network import limiter, stats, configure_session, configure_cache, configure_proxies, configure_archive, \
+    close_archive, delay_to_rate, DELAY, POOL_MAXSIZE
+from cache import CACHE_TTL, CACHE_SIZE
+from checkpoint import CheckpointStore
+from product_index import ProductIndex
+from context import CrawlContext
+from exception import InvalidArgsException
+from json_handler import create_writer, write_memberships, FORMATS
+from frontier import UrlFrontier
+from ingredients import IngredientRegistry
+from store import ProductStore
+from pipeline import PREFETCH
+from distributed import Coordinator, Worker
+from metrics import MetricsExporter, summary as metrics_summary
+from profiling import Profiler, Sampler
+from url_config import EWG_DATABASES
+from scrapers import PARSERS, FIELDS
+from concurrent.futures import ProcessPoolExecutor
 import sys
-import json
-import os
 
 
 if __name__ == '__main__':
@@ -19,24 +34,128 @@ if __name__ == '__main__':
     parser.add_argument('-items_url', type=str)
     parser.add_argument('-url', type=str)
     parser.add_argument('-limit', type=int, default=float('inf'))
+    parser.add_argument('-workers', type=int, default=1)
+    parser.add_argument('-delay', type=float, default=DELAY)
+    parser.add_argument('-max_rate', type=float)
+    parser.add_argument('-async', dest='use_async', action='store_true')
+    parser.add_argument('-pool_size', type=int)
+    parser.add_argument('-proxies', type=str)
+    parser.add_argument('-cache', type=str)
+    parser.add_argument('-cache_ttl', type=int, default=CACHE_TTL)
+    parser.add_argument('-cache_size', type=int, default=CACHE_SIZE)
+    parser.add_argument('-record', type=str)
+    parser.add_argument('-replay', type=str)
+    parser.add_argument('-checkpoint', type=str)
+    parser.add_argument('-resume', action='store_true')
+    parser.add_argument('-format', type=str, choices=FORMATS, default='json')
+    parser.add_argument('-split', action='store_true')
+    parser.add_argument('-ingredients', action='store_true')
+    parser.add_argument('-store', type=str)
+    parser.add_argument('-incremental', type=str)
+    parser.add_argument('-dedupe', action='store_true')
+    parser.add_argument('-parser', type=str, choices=PARSERS)
+    parser.add_argument('-fields', type=str, nargs='+', choices=FIELDS)
+    parser.add_argument('-listing_only', action='store_true')
+    parser.add_argument('-parse_workers', type=int, default=0)
+    parser.add_argument('-prefetch', type=int, default=PREFETCH)
+    parser.add_argument('-parallel_children', type=int, default=1)
+    parser.add_argument('-coordinator', type=str)
+    parser.add_argument('-spawn', type=int, default=0)
+    parser.add_argument('-worker', type=str)
+    parser.add_argument('-metrics_file', type=str)
+    parser.add_argument('-metrics_port', type=int)
+    parser.add_argument('-profile', type=str)
+    parser.add_argument('-sample', type=str)
     args = vars(parser.parse_args())
     try:
-        json_obj = {
-            'skin': [],
-            'cleaning': []
-        }
-        command_hanlder = CommandHandlerFactory.getCommandByArguments(args)
-        limit_flag = False
-        for chunk in command_hanlder.process():
-            for data in chunk:
-                json_obj[data['db']].append(data)
-                if len(json_obj['skin']) + len(json_obj['cleaning']) >= args['limit']:
-                    limit_flag = True
+        limiter.configure(delay_to_rate(args['delay']), args['max_rate'])
+        if args['pool_size'] is None:
+            args['pool_size'] = max(args['workers'] + args['parallel_children'], POOL_MAXSIZE)
+        configure_session(pool_maxsize=args['pool_size'])
+        if args['proxies'] is not None:
+            configure_proxies(args['proxies'])
+        if args['cache'] is not None:
+            configure_cache(args['cache'], args['cache_ttl'], args['cache_size'])
+        if args['record'] is not None and args['replay'] is not None:
+            raise InvalidArgsException('record and replay can not be used together!')
+        if args['replay'] is not None:
+            limiter.configure(None)
+        if args['resume'] and args['checkpoint'] is None:
+            raise InvalidArgsException('checkpoint should be specified if you want to resume!')
+        distributed = args['coordinator'] is not None or args['worker'] is not None
+        if distributed and (args['checkpoint'] is not None or args['url'] is not None or args['dedupe']
+                            or args['record'] is not None):
+            raise InvalidArgsException('checkpoint, url, dedupe and record can not be used in distributed mode!')
+        configure_archive(args['record'], args['replay'])
+        context = CrawlContext()
+        command_hanlder = CommandHandlerFactory.getCommandByArguments(args, context)
+        ingredients = IngredientRegistry() if args['ingredients'] else None
+        writer = create_writer(EWG_DATABASES.keys(), args['format'], args['split'], ingredients) \
+            if args['worker'] is None else None
+        store = ProductStore(args['store']) if args['store'] is not None and writer is not None else None
+        exporter = MetricsExporter(args['metrics_file'], args['metrics_port']).start()
+        profilers = []
+        if args['profile'] is not None:
+            profilers.append(Profiler(args['profile']).start())
+        if args['sample'] is not None:
+            profilers.append(Sampler(args['sample']).start())
+        try:
+            if args['checkpoint'] is not None:
+                context.checkpoint = CheckpointStore(args['checkpoint'], resume=args['resume'])
+                writer.write(context.checkpoint.items())
+                if store is not None:
+                    store.write(context.checkpoint.items())
+            if args['incremental'] is not None:
+                context.index = ProductIndex(args['incremental'])
+            if args['dedupe']:
+                context.frontier = UrlFrontier()
+            if args['parse_workers'] > 0:
+                context.parse_pool = ProcessPoolExecutor(max_workers=args['parse_workers'])
+            if args['worker'] is not None:
+                Worker(args['worker'], args, context).run()
+                chunks = []
+            elif args['coordinator'] is not None:
+                chunks = Coordinator(args['coordinator'], command_hanlder, args['spawn']).chunks()
+            elif args['parallel_children'] > 1 and args['url'] is None:
+                if args['use_async']:
+                    chunks = command_hanlder.process_parallel_async(args['parallel_children'])
+                else:
+                    chunks = command_hanlder.process_parallel(args['parallel_children'])
+            elif args['use_async'] and args['url'] is None:
+                chunks = command_hanlder.process_async()
+            else:
+                chunks = command_hanlder.process()
+            for chunk in chunks:
+                remaining = args['limit'] - writer.count
+                chunk = chunk if remaining >= len(chunk) else chunk[:remaining]
+                writer.write(chunk)
+                if store is not None:
+                    store.write(chunk)
+                if writer.count >= args['limit']:
+                    chunks.close()
                     break
-            if limit_flag:
-                break
-        json_file = create_json()
-        json_file.write(json.dumps(json_obj))
-        json_file.close()
+        finally:
+            if writer is not None:
+                writer.close()
+            if store is not None:
+                logger.info(f'Store: {store.summary()}')
+                store.close()
+            if context.checkpoint is not None:
+                context.checkpoint.close()
+            if context.index is not None:
+                context.index.close()
+            if context.parse_pool is not None:
+                context.parse_pool.shutdown()
+            if context.frontier is not None and writer is not None:
+                write_memberships(writer.created, context.frontier.memberships())
+                logger.info(f'Frontier: {context.frontier.summary()}')
+            for profiler in profilers:
+                profiler.close()
+            exporter.close()
+            close_archive()
+            if ingredients is not None:
+                logger.info(f'Ingredients: {ingredients.summary()}')
+        logger.info(f'Transfer stats: {stats.summary()}')
+        logger.info(f'Crawl metrics: {metrics_summary()}')
     except Exception as e:
         logger.exception(e)
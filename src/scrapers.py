@@ -1,31 +1,127 @@
 from abc import ABC, abstractmethod
 from network import get_html_by_url
 from bs4 import BeautifulSoup
+from lxml_parser import LxmlDocument
 from columns import *
 from contextlib import suppress
+from functools import wraps
 from urllib.parse import urljoin
+import hashlib
 import logging
 import re
+import time
 
 
 logger = logging.getLogger(__name__)
 
 DOMAIN = 'https://www.ewg.org/'
+PARSERS = ['bs4', 'lxml']
+
+SUN_CHEMICAL_SCORE = re.compile(r'-(\d+).png')
+SUN_SCORE = re.compile(r'EWG_SunscreenScores-(\d+)')
+SUN_BRAND_TITLE = re.compile(r'see more sunscreens by .+?')
+SKIN_BRAND_HREF = re.compile(r'/brands/.+?')
+SKIN_CHEMICAL_SCORE = re.compile(r'/score-(\d+?)-')
+SKIN_SCORE = re.compile(r'score-(.+?)-')
+SKIN_DEEP_CONCERN = re.compile(r' concern is (\w+)')
+SKIN_DEEP_LABELS = ('Cancer', 'Developmental &amp; reproductive toxicity', 'Allergies &amp; immunotoxicity')
+FIELDS = {
+    'ingredients': LIST_OF_INGREDIENTS,
+    'score': EWG_SCORE,
+    'upc': UPC_CODE,
+    'chemicals': CHEMICALS,
+    'skin_deep': SKIN_DEEP,
+    'cleaning': CLEANING
+}
+ITEM_FIELDS = [LIST_OF_INGREDIENTS, EWG_SCORE, UPC_CODE, TERA_CATEGORY, URL, DB, CHEMICALS, SKIN_DEEP, CLEANING]
+
+
+def create_parser(html, backend):
+    if backend == 'lxml':
+        return LxmlDocument(html)
+    return BeautifulSoup(html, 'lxml')
+
+
+def scrape_html(scraper_cls, html, parser=None, **kwargs):
+    scraper = scraper_cls(html, parser)
+    return scraper.scrape_item(**kwargs), scraper.timings
+
+
+def timed(method):
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.timings.append((f'{type(self).__name__}.{name}', time.perf_counter() - started))
+    return wrapper
+
 
 class Scraper(ABC):
 
-    def __init__(self, html):
+    PARSER = 'bs4'
+    EXTRACTORS = {}
+
+    def __init__(self, html, parser=None):
         self.html = html
-        self.parser = BeautifulSoup(html, 'lxml')
+        self.timings = []
+        started = time.perf_counter()
+        self.parser = create_parser(html, parser or self.PARSER)
+        self.timings.append((f'{type(self).__name__}.create_parser', time.perf_counter() - started))
 
     @abstractmethod
+    def scrape_items_page_entries(self):
+        pass
+
     def scrape_items_page(self):
+        next_link, entries = self.scrape_items_page_entries()
+        return next_link, set(entries)
+
+    def scrape_listing_records(self, **kwargs):
+        return {}
+
+    def _listing_record(self, url, name, brand, score, kwargs):
+        return {PRODUCT_NAME: name, BRAND: brand, EWG_SCORE: score, TERA_CATEGORY: kwargs['category'], URL: url,
+                DB: kwargs['db']}
+
+    def listing_fingerprint(self, tile):
+        text = ' '.join(tile.text.split())
+        images = ' '.join(img.get('src', '') for img in tile.select('img'))
+        return hashlib.sha1(f'{text}|{images}'.encode('utf-8')).hexdigest()
+
+    @abstractmethod
+    def _get_product_name(self):
         pass
 
     @abstractmethod
-    def scrape_item(self, **kwargs):
+    def _get_brand(self):
         pass
-    
+
+    def _get_upc_code(self):
+        return None
+
+    @timed
+    def scrape_item(self, fields=None, **kwargs):
+        try:
+            data = {PRODUCT_NAME: self._get_product_name(), BRAND: self._get_brand()}
+            if not data[PRODUCT_NAME] or not data[BRAND]:
+                logger.debug(f'{PRODUCT_NAME} or {BRAND} is abscent, do not saving item')
+                return None
+            selected = None if fields is None else {FIELDS[field] for field in fields}
+            context = {TERA_CATEGORY: kwargs['category'], URL: kwargs['url'], DB: kwargs['db']}
+            for field in ITEM_FIELDS:
+                if field in context:
+                    data[field] = context[field]
+                elif field in self.EXTRACTORS and (selected is None or field in selected):
+                    data[field] = getattr(self, self.EXTRACTORS[field])()
+            return data
+        except Exception as e:
+            logger.exception(e)
+            return None
+
     def get_text_by_selector(self, selector):
         node = self.parser.select_one(selector)
         if node:
@@ -41,26 +137,40 @@ class Scraper(ABC):
 
 class SunScraper(Scraper):
 
-    def __init__(self, html):
-        super(SunScraper, self).__init__(html)
+    EXTRACTORS = {
+        LIST_OF_INGREDIENTS: '_get_list_of_ingridients',
+        EWG_SCORE: '_get_score',
+        UPC_CODE: '_get_upc_code',
+        CHEMICALS: '_get_chemicals',
+        SKIN_DEEP: '_get_skin_deep'
+    }
 
-    def scrape_items_page(self):
+    def __init__(self, html, parser=None):
+        super(SunScraper, self).__init__(html, parser)
+
+    @timed
+    def scrape_items_page_entries(self):
         next_link = None
         try:
             link_elements = self.parser.select('ul.search_results_list li a')
             if link_elements:
-                links = set([link['href'] for link in link_elements])
+                entries = {}
+                for link in link_elements:
+                    tile = link.find_parent('li') or link
+                    entries.setdefault(link['href'], self.listing_fingerprint(tile))
                 next_url_elements = self.parser.select('ul.cd-pagination li.button a')
                 if next_url_elements:
                     next_link = next_url_elements[-1]['href']
-                return next_link, links
+                return next_link, entries
         except Exception as e:
             logger.exception(e)
-        return None, []
+        return None, {}
 
+    @timed
     def _get_product_name(self):
         return self.get_text_by_selector('h1.tyty2015_class_truncate_title_specific_product_page')
 
+    @timed
     def _get_list_of_ingridients(self):
         ingridients = []
         try:
@@ -71,6 +181,7 @@ class SunScraper(Scraper):
             logger.exception(e)
         return ', '.join(ingridients)
     
+    @timed
     def _get_chemicals(self):
         chemicals = []
         try:
@@ -85,84 +196,101 @@ class SunScraper(Scraper):
                     data = {
                         NAME: self.get_text_by_selector_in_cont(ingridient, 'a'),
                         CONCERNS: concern,
-                        EWG_SCORE: re.search(r'-(\d+).png', score).group(1)
+                        EWG_SCORE: SUN_CHEMICAL_SCORE.search(score).group(1)
                     }
                     chemicals.append(data)
         except Exception as e:
             logger.exception(e)
         return chemicals
     
+    @timed
     def _get_score(self):
         imgs = self.parser.select('img[title="Score"][alt="Score"]')
         if imgs:
             with suppress(Exception):
                 img = [img for img in imgs if img['src'] and not img['src'].startswith('data:image')][0]
                 src = img['src']
-                score = re.search(r'EWG_SunscreenScores-(\d+)', src)
+                score = SUN_SCORE.search(src)
                 if score:
                     return score.group(1)
                 return 'VERIFIED'
     
+    @timed
     def _get_brand(self):
         with suppress(Exception):
-            element = self.parser.find('a', {'title': re.compile(r'see more sunscreens by .+?')})
+            element = self.parser.find('a', {'title': SUN_BRAND_TITLE})
             return element.text
 
-    def scrape_item(self, **kwargs):
-        data = {}
-        try:
-            data[PRODUCT_NAME] = self._get_product_name()
-            data[BRAND] = self._get_brand()
-            data[LIST_OF_INGREDIENTS] = self._get_list_of_ingridients()
-            data[EWG_SCORE] = self._get_score()
-            data[UPC_CODE] = None
-            data[TERA_CATEGORY] = kwargs['category']
-            data[URL] = kwargs['url']
-            data['db'] = kwargs['db']
-            data[CHEMICALS] = self._get_chemicals()
-            data[SKIN_DEEP] = {
-                CANCER: None,
-                DEVELOPMENTAL_REPRODUCTIVE_TOXICITY: None,
-                ALLERGIES_IMMUNOTOXICITY: None,
-                USE_RESTRICTIONS: None
-            }
-            if not data[PRODUCT_NAME] or not data[BRAND]:
-                logger.debug(f'{PRODUCT_NAME} or {BRAND} is abscent, do not saving item')
-                return None
-            return data
-        except Exception as e:
-            logger.exception(e)
-            return None
+    def _get_skin_deep(self):
+        return {
+            CANCER: None,
+            DEVELOPMENTAL_REPRODUCTIVE_TOXICITY: None,
+            ALLERGIES_IMMUNOTOXICITY: None,
+            USE_RESTRICTIONS: None
+        }
 
 
 class SkinScraper(Scraper):
 
-    def __init__(self, html):
-        super(SkinScraper, self).__init__(html)
+    EXTRACTORS = {
+        LIST_OF_INGREDIENTS: '_get_list_of_ingridients',
+        EWG_SCORE: '_get_score',
+        UPC_CODE: '_get_upc_code',
+        CHEMICALS: '_get_chemicals',
+        SKIN_DEEP: '_get_skin_deep'
+    }
 
-    def scrape_items_page(self):
+    def __init__(self, html, parser=None):
+        super(SkinScraper, self).__init__(html, parser)
+
+    @timed
+    def scrape_items_page_entries(self):
         next_link = None
         try:
             link_elements = self.parser.select('section.product-listings div.product-tile a')
             if link_elements:
-                links = set([urljoin(DOMAIN, link['href']) for link in link_elements])
+                entries = {}
+                for link in link_elements:
+                    tile = link.find_parent('div', class_='product-tile') or link
+                    entries.setdefault(urljoin(DOMAIN, link['href']), self.listing_fingerprint(tile))
                 next_url_element = self.parser.select_one('a.next_page')
                 if next_url_element:
                     next_link = urljoin(DOMAIN, next_url_element['href'])
-                return next_link, links
+                return next_link, entries
         except Exception as e:
             logger.exception(e)
-        return None, []
+        return None, {}
     
+    @timed
+    def scrape_listing_records(self, **kwargs):
+        records = {}
+        try:
+            for tile in self.parser.select('section.product-listings div.product-tile'):
+                with suppress(Exception):
+                    link = tile.select_one('a')
+                    name = self.get_text_by_selector_in_cont(tile, 'div.product-name')
+                    brand = self.get_text_by_selector_in_cont(tile, 'div.product-company')
+                    if not name or not brand:
+                        continue
+                    score = self._score_from_src(tile.select_one('div.product-score img')['src'])
+                    url = urljoin(DOMAIN, link['href'])
+                    records.setdefault(url, self._listing_record(url, name, brand, score, kwargs))
+        except Exception as e:
+            logger.exception(e)
+        return records
+
+    @timed
     def _get_product_name(self):
         return self.get_text_by_selector('h2.product-name')
     
+    @timed
     def _get_brand(self):
         with suppress(Exception):
-            brand_container = self.parser.find('a', {'href': re.compile(r'/brands/.+?')})
+            brand_container = self.parser.find('a', {'href': SKIN_BRAND_HREF})
             if brand_container:
                 return self.get_text_by_selector_in_cont(brand_container, 'div')
 
+    @timed
     def _get_list_of_ingridients(self):
         try:
             return self.parser.select_one('section#label-information').select_one('p').text.strip()
@@ -175,8 +303,9 @@ class SkinScraper(Scraper):
                 return ', '.join(ingridients)
     
     def _extract_score_from_url(self, src):
-        return int(re.search(r'/score-(\d+?)-', src).group(1))
+        return int(SKIN_CHEMICAL_SCORE.search(src).group(1))
     
+    @timed
     def _get_chemicals(self):
         chemicals = []
         try:
@@ -201,70 +330,65 @@ class SkinScraper(Scraper):
             logger.exception(e)
         return chemicals
     
+    @timed
     def _get_skin_deep(self):
-        skin_deep = {
-            CANCER: None,
-            DEVELOPMENTAL_REPRODUCTIVE_TOXICITY: None,
-            ALLERGIES_IMMUNOTOXICITY: None,
-            USE_RESTRICTIONS: None
+        first, last = {}, {}
+        for match in SKIN_DEEP_CONCERN.finditer(self.html):
+            start = match.start()
+            for label in SKIN_DEEP_LABELS:
+                if start >= len(label) and self.html.startswith(label, start - len(label)):
+                    first.setdefault(label, match.group(1))
+                    last[label] = match.group(1)
+                    break
+        cancer, developmental, allergies = SKIN_DEEP_LABELS
+        return {
+            CANCER: first.get(cancer),
+            DEVELOPMENTAL_REPRODUCTIVE_TOXICITY: first.get(developmental),
+            ALLERGIES_IMMUNOTOXICITY: first.get(allergies),
+            USE_RESTRICTIONS: last.get(allergies)
         }
-        items = [(CANCER, 'Cancer', 0), 
-                (DEVELOPMENTAL_REPRODUCTIVE_TOXICITY, 'Developmental &amp; reproductive toxicity', 0),
-                (ALLERGIES_IMMUNOTOXICITY, 'Allergies &amp; immunotoxicity', 0),
-                (USE_RESTRICTIONS, 'Allergies &amp; immunotoxicity', -1)]
-        for key, substr, index in items:
-            with suppress(Exception):
-                regex = re.compile(rf'{substr} concern is (\w+)', re.IGNORECASE)
-                concern = re.findall(rf'{substr} concern is (\w+)', self.html)[index]
-                skin_deep[key] = concern
-        return skin_deep
     
+    def _score_from_src(self, src):
+        return SKIN_SCORE.search(src).group(1).lstrip('0')
+
+    @timed
     def _get_score(self):
         with suppress(Exception):
-            src = self.parser.select_one('div.product-score img')['src']
-            score = re.search(r'score-(.+?)-', src).group(1).replace('0', '')
-            return score
-    
-    def scrape_item(self, **kwargs):
-        data = {}
-        try:
-            data[PRODUCT_NAME] = self._get_product_name()
-            data[BRAND] = self._get_brand()
-            data[LIST_OF_INGREDIENTS] = self._get_list_of_ingridients()
-            data[EWG_SCORE] = self._get_score()
-            data[UPC_CODE] = None
-            data[TERA_CATEGORY] = kwargs['category']
-            data[URL] = kwargs['url']
-            data['db'] = kwargs['db']
-            data[CHEMICALS] = self._get_chemicals()
-            data[SKIN_DEEP] = self._get_skin_deep()
-            if not data[PRODUCT_NAME] or not data[BRAND]:
-                logger.debug(f'{PRODUCT_NAME} or {BRAND} is abscent, do not saving item')
-                return None
-            return data
-        except Exception as e:
-            logger.exception(e)
-            return None
+            return self._score_from_src(self.parser.select_one('div.product-score img')['src'])
+
 
 class CleaningScraper(Scraper):
 
-    def __init__(self, html):
-        super(CleaningScraper, self).__init__(html)
+    EXTRACTORS = {
+        LIST_OF_INGREDIENTS: '_get_list_of_ingridients',
+        EWG_SCORE: '_get_score',
+        UPC_CODE: '_get_upc_code',
+        CHEMICALS: '_get_chemicals',
+        CLEANING: '_get_cleaning'
+    }
+
+    def __init__(self, html, parser=None):
+        super(CleaningScraper, self).__init__(html, parser)
     
-    def scrape_items_page(self):
+    @timed
+    def scrape_items_page_entries(self):
         next_link = None
         try:
             link_elements = self.parser.select('div.individual_products_row div.individual_products_row_col2 a')
             if link_elements:
-                links = set([urljoin(DOMAIN, link['href']) for link in link_elements])
+                entries = {}
+                for link in link_elements:
+                    tile = link.find_parent('div', class_='individual_products_row') or link
+                    entries.setdefault(urljoin(DOMAIN, link['href']), self.listing_fingerprint(tile))
                 next_url_element = self.parser.select_one('a.next_page')
                 if next_url_element:
                     next_link = urljoin(DOMAIN, next_url_element['href'])
-                return next_link, links
+                return next_link, entries
         except Exception as e:
             logger.exception(e)
-        return None, []
+        return None, {}
     
+    @timed
     def _get_product_name(self):
         return self.get_text_by_selector('h1.h1large') or \
                self.get_text_by_selector('h1.h1medium') or \
@@ -272,6 +396,7 @@ class CleaningScraper(Scraper):
                self.get_text_by_selector('h1.h1verysmall') or \
                self.get_text_by_selector('div#productname')
     
+    @timed
     def _get_brand(self):
         with suppress(Exception):
             containers = self.parser.select('div#prodname_name')
@@ -283,6 +408,7 @@ class CleaningScraper(Scraper):
                             brand = brand[:-3]
                         return brand.strip()
 
+    @timed
     def _get_cleaning(self):
         cleaning = {}
         try:
@@ -299,6 +425,7 @@ class CleaningScraper(Scraper):
             logger.exception(e)
         return cleaning
 
+    @timed
     def _get_list_of_ingridients(self):
         ingridients = []
         try:
@@ -310,6 +437,7 @@ class CleaningScraper(Scraper):
             logger.exception(e)
         return ', '.join(ingridients)
     
+    @timed
     def _get_chemicals(self):
         chemicals = []
         try:
@@ -325,23 +453,6 @@ class CleaningScraper(Scraper):
             logger.exception(e)
         return chemicals
 
-    def scrape_item(self, **kwargs):
-        data = {}
-        try:
-            data[PRODUCT_NAME] = self._get_product_name()
-            data[BRAND] = self._get_brand()
-            data[LIST_OF_INGREDIENTS] = self._get_list_of_ingridients()
-            data[EWG_SCORE] = self.get_text_by_selector('a[rel="popup_scores_product"]')
-            data[UPC_CODE] = None
-            data[TERA_CATEGORY] = kwargs['category']
-            data[URL] = kwargs['url']
-            data['db'] = kwargs['db']
-            data[CHEMICALS] = self._get_chemicals()
-            data[CLEANING] = self._get_cleaning()
-            if not data[PRODUCT_NAME] or not data[BRAND]:
-                logger.debug(f'{PRODUCT_NAME} or {BRAND} is abscent, do not saving item')
-                return None
-            return data
-        except Exception as e:
-            logger.exception(e)
-            return None
+    @timed
+    def _get_score(self):
+        return self.get_text_by_selector('a[rel="popup_scores_product"]')
@@ -0,0 +1,141 @@
+from columns import *
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+INGREDIENT_SEPARATOR = ', '
+FILTERS = {
+    'db': 'p.db = ?',
+    'category': 'p.category = ?',
+    'brand': 'p.brand = ? COLLATE NOCASE',
+    'ingredient': 'p.url IN (SELECT url FROM product_ingredients WHERE name = ? COLLATE NOCASE)',
+}
+
+
+def product_ingredients(data):
+    names = {chemical.get(NAME) for chemical in data.get(CHEMICALS) or []}
+    ingredients = data.get(LIST_OF_INGREDIENTS)
+    if isinstance(ingredients, str):
+        names.update(ingredients.split(INGREDIENT_SEPARATOR))
+    names.discard(None)
+    names.discard('')
+    return names
+
+
+class ProductStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = []
+        self.count = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS products ('
+                                'url TEXT PRIMARY KEY, db TEXT NOT NULL, category TEXT, brand TEXT, name TEXT, '
+                                'score TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS product_ingredients ('
+                                'url TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (url, name)) WITHOUT ROWID')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS products_brand ON products (brand COLLATE NOCASE)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS products_category ON products (category)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS products_score ON products (score)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS product_ingredients_name '
+                                'ON product_ingredients (name COLLATE NOCASE)')
+        self.connection.commit()
+
+    def write(self, chunk):
+        with self.lock:
+            self.pending.extend(chunk)
+            if len(self.pending) >= BATCH_SIZE:
+                self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        now = time.time()
+        products = {data[URL]: data for data in self.pending}
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO products (url, db, category, brand, name, score, data, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(url) DO UPDATE SET db = excluded.db, '
+                'category = excluded.category, brand = excluded.brand, name = excluded.name, '
+                'score = excluded.score, data = excluded.data, updated_at = excluded.updated_at',
+                [(url, data[DB], data.get(TERA_CATEGORY), data.get(BRAND), data.get(PRODUCT_NAME),
+                  data.get(EWG_SCORE), json.dumps(data), now) for url, data in products.items()])
+            self.connection.executemany('DELETE FROM product_ingredients WHERE url = ?',
+                                        [(url,) for url in products])
+            self.connection.executemany('INSERT INTO product_ingredients (url, name) VALUES (?, ?)',
+                                        [(url, name) for url, data in products.items()
+                                         for name in product_ingredients(data)])
+        self.count += len(products)
+        self.pending.clear()
+
+    def get(self, url):
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM products WHERE url = ?', (url,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find(self, db=None, category=None, brand=None, ingredient=None, scores=None, limit=None):
+        values = {'db': db, 'category': category, 'brand': brand, 'ingredient': ingredient}
+        conditions = [FILTERS[key] for key, value in values.items() if value is not None]
+        parameters = [value for value in values.values() if value is not None]
+        if scores:
+            conditions.append(f'p.score IN ({", ".join("?" * len(scores))})')
+            parameters.extend(scores)
+        query = 'SELECT p.data FROM products p'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def items(self):
+        with self.lock:
+            self._flush()
+        for data, in self.connection.execute('SELECT data FROM products'):
+            yield json.loads(data)
+
+    def summary(self):
+        with self.lock:
+            self._flush()
+            products, = self.connection.execute('SELECT COUNT(*) FROM products').fetchone()
+            ingredients, = self.connection.execute(
+                'SELECT COUNT(DISTINCT name) FROM product_ingredients').fetchone()
+        return f'{products} products, {ingredients} ingredients in {self.path} ({self.count} upserted this run)'
+
+    def close(self):
+        with self.lock:
+            self._flush()
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(filename)s %(levelname)s:%(message)s')
+    parser = argparse.ArgumentParser(description='Query a product store written with -store.')
+    parser.add_argument('path', type=str)
+    parser.add_argument('-url', type=str)
+    parser.add_argument('-db', type=str)
+    parser.add_argument('-category', type=str)
+    parser.add_argument('-brand', type=str)
+    parser.add_argument('-ingredient', type=str)
+    parser.add_argument('-score', dest='scores', type=str, nargs='+')
+    parser.add_argument('-limit', type=int)
+    args = vars(parser.parse_args())
+    store = ProductStore(args.pop('path'))
+    try:
+        url = args.pop('url')
+        products = [store.get(url)] if url is not None else store.find(**args)
+        for data in products:
+            if data is not None:
+                print(json.dumps(data))
+    finally:
+        store.close()